@@ -1,32 +1,53 @@
 import logging
 import asyncio
+import copy
+import csv
+import gzip
+import heapq
+import html
+import io
+import itertools
 import json
 import os
 import random
+import re
+import sqlite3
+import sys
+import threading
+import time
 import uuid
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, deque
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Iterable, Iterator
 import tempfile
 
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import Bot, Dispatcher, BaseMiddleware, types, F
 from aiogram.filters import Command
 from aiogram.types import (
     ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, 
-    InlineKeyboardButton, BufferedInputFile
+    InlineKeyboardButton, BufferedInputFile, FSInputFile
 )
 from aiogram.enums import ParseMode
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+from aiogram.exceptions import DataNotDictLikeError, TelegramAPIError, TelegramRetryAfter
 from aiogram.client.default import DefaultBotProperties
 
 # PDF and Excel libraries
 try:
     from reportlab.lib.pagesizes import letter, A4, landscape
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
-    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, PageBreak
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
     from reportlab.lib import colors
     import openpyxl
-    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
     import PyPDF2
     from io import BytesIO
 except ImportError:
@@ -37,13 +58,16 @@ TOKEN = os.getenv("BOT_TOKEN", "7570796885:AAHHfpXanemNYvW-wVT2Rv40U0xq-XjxSwk")
 SUPER_ADMIN_ID = int(os.getenv("SUPER_ADMIN_ID", "6578706277, 7853664401"))
 CHANNEL_USERNAME = "@Kitobxon_Kids"
 
+# 📝 Test stages: questions per test and seconds per question
+TEST_STAGES = {
+    "saralash": {"questions": 25, "seconds": 60},
+    "hududiy": {"questions": 30, "seconds": 30},
+}
+TEST_STAGE = TEST_STAGES[os.getenv("TEST_STAGE", "saralash")]
+
 # 🛠 Logging
 logging.basicConfig(level=logging.INFO)
 
-# 🤖 Bot and Dispatcher
-bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
-
 # 📁 Data storage files
 DATA_DIR = "bot_data"
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -51,7 +75,72 @@ os.makedirs(DATA_DIR, exist_ok=True)
 USERS_FILE = os.path.join(DATA_DIR, "users.json")
 ADMINS_FILE = os.path.join(DATA_DIR, "admins.json")
 TESTS_FILE = os.path.join(DATA_DIR, "tests.json")
-RESULTS_FILE = os.path.join(DATA_DIR, "results.json")
+RESULTS_FILE = os.path.join(DATA_DIR, "results.json")  # legacy, read-only
+RESULTS_LOG_FILE = os.path.join(DATA_DIR, "results.jsonl")
+DB_FILE = os.path.join(DATA_DIR, "bot.db")
+FSM_DB_FILE = os.path.join(DATA_DIR, "fsm.db")
+REPORTS_DIR = os.path.join(DATA_DIR, "reports")
+QUESTION_STATS_FILE = os.path.join(DATA_DIR, "question_stats.json")
+LEADERBOARDS_FILE = os.path.join(DATA_DIR, "leaderboards.json")
+
+# "json" (default) or "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+# Saves of the same JSON file within this window are flushed to disk once
+SAVE_DELAY = float(os.getenv("SAVE_DELAY", "0.5"))
+# FSM sessions changed within this window are written to fsm.db once
+FSM_SAVE_DELAY = float(os.getenv("FSM_SAVE_DELAY", "1"))
+# Threads that run file and database work outside the event loop
+STORAGE_WORKERS = int(os.getenv("STORAGE_WORKERS", "4"))
+# Worker processes that render PDF/Excel reports and read uploaded PDFs, and seconds between progress updates
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", "2"))
+REPORT_PROGRESS_INTERVAL = float(os.getenv("REPORT_PROGRESS_INTERVAL", "3"))
+# Admin notifications: parallel sends, messages per second overall,
+# seconds between messages to one chat and retries after flood waits
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "8"))
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))
+NOTIFY_CHAT_INTERVAL = float(os.getenv("NOTIFY_CHAT_INTERVAL", "1"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "3"))
+# Digest mode for admin notifications: "off" (always real time), "on" (always digest),
+# "auto" (digest while more than DIGEST_THRESHOLD events arrive within DIGEST_INTERVAL seconds)
+NOTIFY_DIGEST = os.getenv("NOTIFY_DIGEST", "auto")
+DIGEST_INTERVAL = float(os.getenv("DIGEST_INTERVAL", "300"))
+DIGEST_THRESHOLD = int(os.getenv("DIGEST_THRESHOLD", "30"))
+DIGEST_TABLE_ROWS = 10
+# Channel subscription cache: seconds to trust a "subscribed" / "not subscribed" answer.
+# With SUB_RECHECK_INTERVAL > 0 a background job refreshes subscribed users before they expire,
+# SUB_RECHECK_BATCH at a time and at most SUB_RECHECK_RATE checks per second
+SUB_CACHE_TTL = float(os.getenv("SUB_CACHE_TTL", "3600"))
+SUB_CACHE_NEGATIVE_TTL = float(os.getenv("SUB_CACHE_NEGATIVE_TTL", "30"))
+SUB_RECHECK_INTERVAL = float(os.getenv("SUB_RECHECK_INTERVAL", "0"))
+SUB_RECHECK_BATCH = int(os.getenv("SUB_RECHECK_BATCH", "20"))
+SUB_RECHECK_RATE = float(os.getenv("SUB_RECHECK_RATE", "10"))
+# Admin names/usernames shown in admin lists: seconds a cached profile is trusted,
+# seconds before a failed lookup is retried, and parallel getChat calls on cache misses
+ADMIN_PROFILE_TTL = float(os.getenv("ADMIN_PROFILE_TTL", "86400"))
+ADMIN_PROFILE_RETRY = float(os.getenv("ADMIN_PROFILE_RETRY", "300"))
+ADMIN_PROFILE_CONCURRENCY = int(os.getenv("ADMIN_PROFILE_CONCURRENCY", "5"))
+# Uploaded question PDFs: largest file in MB, most pages, and pages read per worker task
+PDF_UPLOAD_MAX_MB = float(os.getenv("PDF_UPLOAD_MAX_MB", "20"))
+PDF_UPLOAD_MAX_PAGES = int(os.getenv("PDF_UPLOAD_MAX_PAGES", "1000"))
+PDF_PAGE_BATCH = int(os.getenv("PDF_PAGE_BATCH", "20"))
+# Longest question or option text accepted from uploads, counted as escaped HTML (Telegram messages hold 4096)
+QUESTION_TEXT_MAX_CHARS = int(os.getenv("QUESTION_TEXT_MAX_CHARS", "3500"))
+# Rendered question messages (text and answer keyboard) kept in memory
+QUESTION_CACHE_SIZE = int(os.getenv("QUESTION_CACHE_SIZE", "2000"))
+# Users shown per page in the admin user browser
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", "10"))
+# PDF reports: rows measured and laid out at a time, and rows per file before a report is split (0 = never split)
+PDF_CHUNK_ROWS = int(os.getenv("PDF_CHUNK_ROWS", "30"))
+PDF_MAX_ROWS = int(os.getenv("PDF_MAX_ROWS", "20000"))
+# gzip level of raw CSV/NDJSON exports (1 = fastest, 9 = smallest)
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+# Question analytics: answers a question needs before it is ranked, and questions listed per book
+QUESTION_STATS_MIN_ATTEMPTS = int(os.getenv("QUESTION_STATS_MIN_ATTEMPTS", "5"))
+QUESTION_STATS_TOP = int(os.getenv("QUESTION_STATS_TOP", "3"))
+# Users kept on each leaderboard (per region, district and age group)
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "50"))
+# Event loop stalls longer than this are counted in /stats
+LOOP_LAG_WARN_MS = float(os.getenv("LOOP_LAG_WARN_MS", "5"))
 
 # 📌 Regions data
 REGIONS = {
@@ -72,91 +161,1743 @@ REGIONS = {
 }
 
 # 📌 Data management functions
+# Parsed JSON files kept in memory: file path -> ((mtime_ns, size), data)
+_json_cache: Dict[str, tuple] = {}
+CACHE_STATS = {"hits": 0, "misses": 0}
+# Saved but not yet flushed data: file path -> (generation, data)
+_pending_saves: Dict[str, tuple] = {}
+_flush_tasks: Dict[str, asyncio.Task] = {}
+_file_locks: Dict[str, asyncio.Lock] = {}
+_save_generation = 0
+PERSIST_STATS = {"saves": 0, "writes": 0}
+# JSON data is shared between the event loop and storage threads
+_json_lock = threading.RLock()
+# Event loop that owns the delayed flushes, set in main()
+_storage_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _file_signature(file_path: str) -> Optional[tuple]:
+    """Return (mtime_ns, size) of a file or None if it doesn't exist"""
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
 def load_json_data(file_path: str, default_data: Any = None) -> Any:
-    """Load data from JSON file"""
-    if not os.path.exists(file_path):
-        return default_data or {}
-    
+    """Load data from JSON file, served from memory while the file is unchanged"""
+    with _json_lock:
+        pending = _pending_saves.get(file_path)
+        if pending is not None:
+            CACHE_STATS["hits"] += 1
+            return pending[1]
+        
+        signature = _file_signature(file_path)
+        cached = _json_cache.get(file_path)
+        if cached is not None and signature is not None and cached[0] == signature:
+            CACHE_STATS["hits"] += 1
+            return cached[1]
+        
+        CACHE_STATS["misses"] += 1
+        if signature is None:
+            return default_data or {}
+        
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            return default_data or {}
+        
+        _json_cache[file_path] = (signature, data)
+        return data
+
+def _write_text_atomic(file_path: str, text: str) -> None:
+    """Write text to a temp file and rename it over the target"""
+    _write_bytes_atomic(file_path, text.encode('utf-8'))
+
+def _write_bytes_atomic(file_path: str, data: bytes) -> None:
+    """Write bytes to a temp file and rename it over the target"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or '.',
+                                    prefix=f".{os.path.basename(file_path)}.", suffix=".tmp")
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
-        return default_data or {}
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _write_pending_json(file_path: str) -> None:
+    """Write the latest pending data of a JSON file to disk"""
+    with _json_lock:
+        pending = _pending_saves.get(file_path)
+        if pending is None:
+            return
+        generation, data = pending
+        text = json.dumps(data, ensure_ascii=False, indent=2)
+    
+    _write_text_atomic(file_path, text)
+    
+    with _json_lock:
+        PERSIST_STATS["writes"] += 1
+        _json_cache[file_path] = (_file_signature(file_path), data)
+        if _pending_saves.get(file_path, (None,))[0] == generation:
+            del _pending_saves[file_path]
 
 def save_json_data(file_path: str, data: Any) -> None:
-    """Save data to JSON file"""
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    """Save data to JSON file, coalescing bursts of saves while the bot is running"""
+    global _save_generation
+    try:
+        loop, in_loop = asyncio.get_running_loop(), True
+    except RuntimeError:
+        # Called from a storage thread or without a running bot
+        loop, in_loop = _storage_loop, False
+    
+    with _json_lock:
+        PERSIST_STATS["saves"] += 1
+        # Readers see the new data immediately; the disk write happens after SAVE_DELAY
+        _save_generation += 1
+        _pending_saves[file_path] = (_save_generation, data)
+    
+    if in_loop:
+        _schedule_flush(file_path)
+    elif loop is None or loop.is_closed():
+        # No event loop (e.g. import tool): write right away
+        _write_pending_json(file_path)
+    else:
+        loop.call_soon_threadsafe(_schedule_flush, file_path)
+
+def _schedule_flush(file_path: str) -> None:
+    """Start a delayed flush of a JSON file unless one is already waiting"""
+    if file_path not in _flush_tasks:
+        _flush_tasks[file_path] = asyncio.create_task(_delayed_flush(file_path))
+
+async def _delayed_flush(file_path: str) -> None:
+    """Flush a JSON file once the coalescing window has passed"""
+    await asyncio.sleep(SAVE_DELAY)
+    await flush_json_file(file_path)
+
+async def flush_json_file(file_path: str) -> None:
+    """Write pending data of a JSON file to disk, one writer per file"""
+    lock = _file_locks.setdefault(file_path, asyncio.Lock())
+    async with lock:
+        # Saves made from now on schedule a new flush
+        if _flush_tasks.get(file_path) is asyncio.current_task():
+            del _flush_tasks[file_path]
+        
+        if file_path not in _pending_saves:
+            return
+        
+        try:
+            await run_blocking(_write_pending_json, file_path)
+        except OSError as e:
+            logging.error(f"Error writing {file_path}: {e}")
+            _schedule_flush(file_path)
+
+async def flush_all_json() -> None:
+    """Write all pending JSON data to disk"""
+    for file_path in list(_pending_saves):
+        await flush_json_file(file_path)
+
+def get_cache_stats() -> Dict:
+    """Get JSON cache and persistence counters"""
+    return {**CACHE_STATS, **PERSIST_STATS, "cached_files": len(_json_cache), "pending_files": len(_pending_saves)}
+
+# ⚙️ Blocking work off the event loop
+_storage_executor = ThreadPoolExecutor(max_workers=STORAGE_WORKERS, thread_name_prefix="storage")
+LOOP_STATS = {"max_lag_ms": 0.0, "slow_ticks": 0}
+
+async def run_blocking(func, *args) -> Any:
+    """Run blocking storage or document work on the storage thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_storage_executor, func, *args)
+
+# CPU-heavy work (reports, uploaded PDFs) runs in separate processes so it can't hold the GIL the bot needs.
+# Workers are spawned, not forked: each imports this module fresh with its own database connections.
+_process_executor: Optional[ProcessPoolExecutor] = None
+
+def _get_process_executor() -> ProcessPoolExecutor:
+    global _process_executor
+    if _process_executor is None:
+        _process_executor = ProcessPoolExecutor(max_workers=PROCESS_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+    return _process_executor
+
+async def run_in_process(func, *args) -> Any:
+    """Run a picklable top-level function in the report process pool"""
+    global _process_executor
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_process_executor(), func, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool for the next job
+        _process_executor = None
+        raise
+
+def warm_up_process_pool() -> None:
+    """Start the workers in the background now, so the first report doesn't wait for them to import the bot"""
+    executor = _get_process_executor()
+    for _ in range(PROCESS_WORKERS):
+        executor.submit(os.getpid)
+
+def shutdown_process_pool() -> None:
+    global _process_executor
+    if _process_executor is not None:
+        _process_executor.shutdown(wait=False, cancel_futures=True)
+        _process_executor = None
+
+async def monitor_loop_lag(interval: float = 0.1) -> None:
+    """Measure how late the event loop wakes up to catch blocking calls"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag_ms = (loop.time() - started - interval) * 1000
+        LOOP_STATS["max_lag_ms"] = max(LOOP_STATS["max_lag_ms"], lag_ms)
+        if lag_ms > LOOP_LAG_WARN_MS:
+            LOOP_STATS["slow_ticks"] += 1
+            # Short stalls are only counted, long ones are worth a log line
+            if lag_ms > LOOP_LAG_WARN_MS * 10:
+                logging.warning(f"Event loop was blocked for {lag_ms:.1f} ms")
+
+def get_age_group(age: Any) -> str:
+    """Map child's age to test age group"""
+    return "7-10" if int(age) <= 10 else "11-14"
+
+def parse_age_part(age_part: str) -> Optional[str]:
+    """Age group of a callback data part ("-" is all ages); raises ValueError on unknown values"""
+    if age_part == "-":
+        return None
+    if age_part not in ("7-10", "11-14"):
+        raise ValueError(f"Unknown age group: {age_part!r}")
+    return age_part
+
+_default_admins: Optional[Dict] = None
+
+def get_default_admins() -> Dict:
+    """Admins used when no admin data is stored yet"""
+    global _default_admins
+    if _default_admins is None:
+        _default_admins = {str(SUPER_ADMIN_ID): {"role": "super_admin", "added_by": "system", "added_date": datetime.now().isoformat()}}
+    return _default_admins
+
+# 🗃 SQLite storage backend
+class SQLiteStorage:
+    """SQLite implementation of the get_/save_ data functions"""
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            region TEXT,
+            district TEXT,
+            age_group TEXT,
+            registration_date TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_region_district ON users (region, district);
+        CREATE INDEX IF NOT EXISTS idx_users_age_group ON users (age_group);
+        
+        CREATE TABLE IF NOT EXISTS admins (
+            admin_id TEXT PRIMARY KEY,
+            role TEXT,
+            data TEXT NOT NULL
+        );
+        
+        CREATE TABLE IF NOT EXISTS tests (
+            test_id TEXT PRIMARY KEY,
+            age_group TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_tests_age_group ON tests (age_group);
+        
+        CREATE TABLE IF NOT EXISTS results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER,
+            age_group TEXT,
+            region TEXT,
+            district TEXT,
+            date TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_results_telegram_id ON results (telegram_id);
+        CREATE INDEX IF NOT EXISTS idx_results_region_district ON results (region, district);
+        CREATE INDEX IF NOT EXISTS idx_results_age_group ON results (age_group);
+        CREATE INDEX IF NOT EXISTS idx_results_date ON results (date);
+    """
+    
+    def __init__(self, db_path: str):
+        # One connection shared by the storage threads
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+    
+    @staticmethod
+    def _dumps(data: Any) -> str:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    
+    def _user_row(self, user_id: str, user_data: Dict) -> tuple:
+        age = user_data.get('age')
+        age_group = get_age_group(age) if str(age).isdigit() else None
+        return (user_id, user_data.get('region'), user_data.get('district'), age_group,
+                user_data.get('registration_date'), self._dumps(user_data))
+    
+    def _result_row(self, result_data: Dict) -> tuple:
+        return (result_data.get('telegram_id'), result_data.get('age_group'), result_data.get('region'),
+                result_data.get('district'), result_data.get('date'), self._dumps(result_data))
+    
+    def get_users(self) -> Dict:
+        with self.lock:
+            rows = self.conn.execute("SELECT user_id, data FROM users ORDER BY rowid").fetchall()
+        return {user_id: json.loads(data) for user_id, data in rows}
+    
+    def iter_users(self, batch_size: int = 500) -> Iterator[tuple]:
+        # Fetch in batches so other threads can use the connection in between
+        last_rowid = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute("SELECT rowid, user_id, data FROM users WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                         (last_rowid, batch_size)).fetchall()
+            if not rows:
+                return
+            for last_rowid, user_id, data in rows:
+                yield user_id, json.loads(data)
+    
+    def get_user(self, user_id: str) -> Optional[Dict]:
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def save_user(self, user_id: str, user_data: Dict) -> None:
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?)",
+                              self._user_row(user_id, user_data))
+    
+    def get_admins(self) -> Dict:
+        with self.lock:
+            rows = self.conn.execute("SELECT admin_id, data FROM admins ORDER BY rowid").fetchall()
+        if not rows:
+            return get_default_admins()
+        return {admin_id: json.loads(data) for admin_id, data in rows}
+    
+    def save_admin(self, admin_id: str, admin_data: Dict) -> None:
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO admins VALUES (?, ?, ?)",
+                              (admin_id, admin_data.get('role'), self._dumps(admin_data)))
+    
+    def remove_admin(self, admin_id: str) -> bool:
+        with self.lock, self.conn:
+            cursor = self.conn.execute("DELETE FROM admins WHERE admin_id = ?", (admin_id,))
+        return cursor.rowcount > 0
+    
+    def has_admins(self) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM admins LIMIT 1").fetchone() is not None
+    
+    def get_tests(self) -> Dict:
+        with self.lock:
+            rows = self.conn.execute("SELECT test_id, age_group, data FROM tests ORDER BY rowid").fetchall()
+        tests = {"7-10": {}, "11-14": {}}
+        for test_id, age_group, data in rows:
+            tests.setdefault(age_group, {})[test_id] = json.loads(data)
+        return tests
+    
+    def save_test(self, test_id: str, test_data: Dict) -> None:
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO tests VALUES (?, ?, ?)",
+                              (test_id, test_data["age_group"], self._dumps(test_data)))
+    
+    def delete_test(self, age_group: str, test_id: str) -> bool:
+        with self.lock, self.conn:
+            cursor = self.conn.execute("DELETE FROM tests WHERE test_id = ? AND age_group = ?", (test_id, age_group))
+        return cursor.rowcount > 0
+    
+    def iter_results(self, from_id: int = 0, batch_size: int = 500) -> Iterator[tuple]:
+        """(id, result) pairs starting at from_id"""
+        # Fetch in batches so other threads can use the connection in between
+        next_id = from_id
+        while True:
+            with self.lock:
+                rows = self.conn.execute("SELECT id, data FROM results WHERE id >= ? ORDER BY id LIMIT ?",
+                                         (next_id, batch_size)).fetchall()
+            if not rows:
+                return
+            for result_id, data in rows:
+                yield result_id, json.loads(data)
+            next_id = rows[-1][0] + 1
+    
+    def get_results(self) -> Iterator[Dict]:
+        for _, result in self.iter_results():
+            yield result
+    
+    @staticmethod
+    def _filter_sql(filters: Dict, date_column: str) -> tuple:
+        clauses, params = [], []
+        for column in ("region", "district", "age_group"):
+            if filters.get(column):
+                clauses.append(f"{column} = ?")
+                params.append(filters[column])
+        if filters.get("date_from"):
+            clauses.append(f"{date_column} >= ?")
+            params.append(filters["date_from"])
+        if filters.get("date_to"):
+            clauses.append(f"{date_column} < ?")
+            params.append(_next_day(filters["date_to"]))
+        return " AND ".join(clauses) or "1", params
+    
+    def _query_by_keys(self, table: str, key_column: str, order_column: str, filters: Dict,
+                       date_column: str, batch_size: int = 500) -> Iterator[tuple]:
+        # Matching keys come from the indexes first, then rows are read a batch at a time
+        where, params = self._filter_sql(filters, date_column)
+        with self.lock:
+            keys = [row[0] for row in self.conn.execute(
+                f"SELECT {key_column} FROM {table} WHERE {where} ORDER BY {order_column}", params)]
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            with self.lock:
+                rows = dict(self.conn.execute(
+                    f"SELECT {key_column}, data FROM {table} WHERE {key_column} IN ({','.join('?' * len(batch))})",
+                    batch).fetchall())
+            for key in batch:
+                if key in rows:
+                    yield key, json.loads(rows[key])
+    
+    def query_results(self, filters: Dict) -> Iterator[Dict]:
+        for _, result in self._query_by_keys("results", "id", "id", filters, "date"):
+            yield result
+    
+    def query_users(self, filters: Dict) -> Iterator[tuple]:
+        return self._query_by_keys("users", "user_id", "rowid", filters, "registration_date")
+    
+    def backfill_result_regions(self) -> None:
+        """Fill region/district of results saved before they were recorded, from the users table"""
+        with self.lock, self.conn:
+            self.conn.execute("""
+                UPDATE results SET
+                    region = (SELECT region FROM users WHERE users.user_id = CAST(results.telegram_id AS TEXT)),
+                    district = (SELECT district FROM users WHERE users.user_id = CAST(results.telegram_id AS TEXT))
+                WHERE region IS NULL
+            """)
+    
+    def results_position(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM results").fetchone()[0]
+    
+    def users_version(self) -> tuple:
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(MAX(rowid), 0), COUNT(*) FROM users").fetchone()
+    
+    def save_result(self, result_data: Dict) -> None:
+        with self.lock, self.conn:
+            self.conn.execute("INSERT INTO results (telegram_id, age_group, region, district, date, data) "
+                              "VALUES (?, ?, ?, ?, ?, ?)", self._result_row(result_data))
+    
+    def import_json(self) -> Dict:
+        """One-shot import of the bot_data/*.json files"""
+        counts = {}
+        with self.lock, self.conn:
+            users = load_json_data(USERS_FILE, {})
+            self.conn.executemany("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?)",
+                                  (self._user_row(user_id, user_data) for user_id, user_data in users.items()))
+            counts['users'] = len(users)
+            
+            admins = load_json_data(ADMINS_FILE, {})
+            self.conn.executemany("INSERT OR REPLACE INTO admins VALUES (?, ?, ?)",
+                                  ((admin_id, admin_data.get('role'), self._dumps(admin_data))
+                                   for admin_id, admin_data in admins.items()))
+            counts['admins'] = len(admins)
+            
+            tests = load_json_data(TESTS_FILE, {})
+            test_rows = [(test_id, age_group, self._dumps(test_data))
+                         for age_group, age_tests in tests.items()
+                         for test_id, test_data in age_tests.items()]
+            self.conn.executemany("INSERT OR REPLACE INTO tests VALUES (?, ?, ?)", test_rows)
+            counts['tests'] = len(test_rows)
+            
+            # Results have no natural key, so only import them into an empty table
+            if self.conn.execute("SELECT 1 FROM results LIMIT 1").fetchone() is None:
+                result_rows = [self._result_row(result) for result in _iter_json_results()]
+                self.conn.executemany("INSERT INTO results (telegram_id, age_group, region, district, date, data) "
+                                      "VALUES (?, ?, ?, ?, ?, ?)", result_rows)
+                counts['results'] = len(result_rows)
+            else:
+                logging.warning("Results table is not empty, skipping results import")
+                counts['results'] = 0
+        return counts
+
+sqlite_storage = SQLiteStorage(DB_FILE) if STORAGE_BACKEND == "sqlite" else None
 
 def get_users() -> Dict:
     """Get all registered users"""
+    if sqlite_storage:
+        return sqlite_storage.get_users()
     return load_json_data(USERS_FILE, {})
 
+def iter_users() -> Iterator[tuple]:
+    """Iterate over (user ID, user data) pairs in registration order"""
+    if sqlite_storage:
+        yield from sqlite_storage.iter_users()
+        return
+    with _json_lock:
+        users = list(get_users().items())
+    yield from users
+
+def get_user(user_id: str) -> Optional[Dict]:
+    """Get a single registered user"""
+    if sqlite_storage:
+        return sqlite_storage.get_user(user_id)
+    return get_users().get(user_id)
+
+def get_users_by_id(user_ids: Iterable[str]) -> Dict:
+    """Get the given registered users, skipping unknown IDs"""
+    users = {}
+    for user_id in user_ids:
+        user_data = get_user(user_id)
+        if user_data is not None:
+            users[user_id] = user_data
+    return users
+
 def save_user(user_id: str, user_data: Dict) -> None:
     """Save user data"""
-    users = get_users()
-    users[user_id] = user_data
-    save_json_data(USERS_FILE, users)
+    if sqlite_storage:
+        sqlite_storage.save_user(user_id, user_data)
+    else:
+        with _json_lock:
+            users = get_users()
+            users[user_id] = user_data
+            save_json_data(USERS_FILE, users)
+    with _json_lock:
+        _index_user(_get_user_index(), user_id, user_data)
 
 def get_admins() -> Dict:
     """Get all admins"""
-    default_admins = {str(SUPER_ADMIN_ID): {"role": "super_admin", "added_by": "system", "added_date": datetime.now().isoformat()}}
-    return load_json_data(ADMINS_FILE, default_admins)
+    if sqlite_storage:
+        return sqlite_storage.get_admins()
+    return load_json_data(ADMINS_FILE, get_default_admins())
 
 def save_admin(admin_id: str, admin_data: Dict) -> None:
     """Save admin data"""
-    admins = get_admins()
-    admins[admin_id] = admin_data
-    save_json_data(ADMINS_FILE, admins)
+    if sqlite_storage:
+        sqlite_storage.save_admin(admin_id, admin_data)
+    else:
+        with _json_lock:
+            admins = get_admins()
+            admins[admin_id] = admin_data
+            save_json_data(ADMINS_FILE, admins)
+    _get_role_index()[admin_id] = admin_data.get("role", "admin")
 
 def remove_admin(admin_id: str) -> bool:
     """Remove admin by ID"""
     try:
-        admins = get_admins()
-        if admin_id in admins:
-            del admins[admin_id]
-            save_json_data(ADMINS_FILE, admins)
-            return True
-        return False
+        if sqlite_storage:
+            removed = sqlite_storage.remove_admin(admin_id)
+        else:
+            with _json_lock:
+                admins = get_admins()
+                removed = admin_id in admins
+                if removed:
+                    del admins[admin_id]
+                    save_json_data(ADMINS_FILE, admins)
+        if removed:
+            _get_role_index().pop(admin_id, None)
+        return removed
     except Exception as e:
         logging.error(f"Error removing admin data: {e}")
         return False
 
 def get_tests() -> Dict:
     """Get all tests"""
+    if sqlite_storage:
+        return sqlite_storage.get_tests()
     return load_json_data(TESTS_FILE, {"7-10": {}, "11-14": {}})
 
 def save_test(test_data: Dict) -> None:
     """Save test data"""
-    tests = get_tests()
-    age_group = test_data["age_group"]
     test_id = str(uuid.uuid4())
+    if sqlite_storage:
+        sqlite_storage.save_test(test_id, test_data)
+    else:
+        age_group = test_data["age_group"]
+        with _json_lock:
+            tests = get_tests()
+            
+            if age_group not in tests:
+                tests[age_group] = {}
+            
+            tests[age_group][test_id] = test_data
+            save_json_data(TESTS_FILE, tests)
     
-    if age_group not in tests:
-        tests[age_group] = {}
+    with _json_lock:
+        _get_question_index().add_test(test_id, test_data)
+    question_payloads.add_test(test_id, test_data)
+
+def delete_test(age_group: str, test_id: str) -> bool:
+    """Delete test by age group and ID"""
+    with _json_lock:
+        test_data = get_tests().get(age_group, {}).get(test_id)
+        if test_data is None:
+            return False
+        
+        if sqlite_storage:
+            sqlite_storage.delete_test(age_group, test_id)
+        else:
+            tests = get_tests()
+            del tests[age_group][test_id]
+            save_json_data(TESTS_FILE, tests)
+        
+        _get_question_index().remove_test(test_id, test_data)
+        question_payloads.remove_test(test_id, test_data)
+        return True
+
+def _iter_json_results(offset: Optional[int] = None) -> Iterator[tuple]:
+    """(byte offset, result) pairs from the results log, oldest first; None starts with the legacy results"""
+    if offset is None:
+        # Results saved before the append-only log was introduced; they have no offset to resume from
+        for result in load_json_data(RESULTS_FILE, []):
+            yield None, result
+        offset = 0
+    
+    if not os.path.exists(RESULTS_LOG_FILE):
+        return
     
-    tests[age_group][test_id] = test_data
-    save_json_data(TESTS_FILE, tests)
+    with open(RESULTS_LOG_FILE, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            line_offset, offset = offset, offset + len(line)
+            if not line.strip():
+                continue
+            try:
+                yield line_offset, json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"Skipping corrupt line at byte {line_offset} in {RESULTS_LOG_FILE}")
+
+def iter_results_from(cursor: Optional[int] = None) -> Iterator[tuple]:
+    """(cursor, result) pairs, oldest first, starting at a cursor yielded earlier (None: from the beginning).
+    
+    Cursors are byte offsets in results.jsonl or row IDs in SQLite, so reading new results doesn't
+    rescan old ones; legacy results.json entries yield None.
+    """
+    if sqlite_storage:
+        return sqlite_storage.iter_results(cursor or 0)
+    return _iter_json_results(cursor)
+
+def get_results() -> Iterator[Dict]:
+    """Iterate over all test results, oldest first"""
+    if sqlite_storage:
+        return sqlite_storage.get_results()
+    return (result for _, result in _iter_json_results())
+
+def get_results_version() -> List:
+    """[backend, base, position]: results were only appended since an older version if backend
+    and base match and the position has not gone back"""
+    if sqlite_storage:
+        return ["sqlite", None, sqlite_storage.results_position()]
+    size = _file_signature(RESULTS_LOG_FILE)
+    return ["json", _file_signature(RESULTS_FILE), size[1] if size else 0]
 
-def get_results() -> List:
-    """Get all test results"""
-    return load_json_data(RESULTS_FILE, [])
+def get_users_version() -> List:
+    """Changes whenever a user is saved"""
+    if sqlite_storage:
+        return ["sqlite", *sqlite_storage.users_version()]
+    return ["json", _file_signature(USERS_FILE)]
 
 def save_result(result_data: Dict) -> None:
-    """Save test result"""
-    results = get_results()
-    results.append(result_data)
-    save_json_data(RESULTS_FILE, results)
+    """Append test result to the results log"""
+    if sqlite_storage:
+        with _json_lock:
+            sqlite_storage.save_result(result_data)
+            _record_result(result_data)
+        return
+    line = json.dumps(result_data, ensure_ascii=False, separators=(',', ':')) + '\n'
+    with _json_lock:
+        with open(RESULTS_LOG_FILE, 'ab') as f:
+            offset = f.tell()
+            f.write(line.encode('utf-8'))
+        if _result_index is not None:
+            _index_result(_result_index, offset, result_data, get_users())
+        _record_result(result_data)
+
+def init_storage() -> None:
+    """Create initial data for the selected storage backend"""
+    if sqlite_storage:
+        if not sqlite_storage.has_admins():
+            for admin_id, admin_data in get_default_admins().items():
+                save_admin(admin_id, admin_data)
+        sqlite_storage.backfill_result_regions()
+        return
+    
+    if not os.path.exists(ADMINS_FILE):
+        save_json_data(ADMINS_FILE, get_default_admins())
+    
+    if not os.path.exists(TESTS_FILE):
+        save_json_data(TESTS_FILE, {"7-10": {}, "11-14": {}})
+    
+    if not os.path.exists(USERS_FILE):
+        save_json_data(USERS_FILE, {})
+
+def import_json_to_sqlite() -> None:
+    """Import bot_data/*.json files into the SQLite database"""
+    storage = sqlite_storage or SQLiteStorage(DB_FILE)
+    counts = storage.import_json()
+    logging.info(f"Imported into {DB_FILE}: {counts}")
+
+def load_indexes() -> None:
+    """Build in-memory indexes so handlers never load them on the event loop"""
+    _get_role_index()
+    _get_question_index()
+    _get_user_index()
+    if not sqlite_storage:
+        _get_result_index()
+    for aggregate in RESULT_AGGREGATES:
+        aggregate.load()
+
+def has_results() -> bool:
+    """Check if any test result is stored"""
+    return next(get_results(), None) is not None
+
+def _copy_of(getter, *args) -> Any:
+    """Deep copy of shared data, so nested fields aren't changed by storage threads while callers use them"""
+    with _json_lock:
+        return copy.deepcopy(getter(*args))
+
+# 📌 Async storage API, file and database work runs on the storage thread pool
+async def get_users_async() -> Dict:
+    """Get all registered users"""
+    return await run_blocking(_copy_of, get_users)
+
+async def get_user_async(user_id: str) -> Optional[Dict]:
+    """Get a single registered user"""
+    return await run_blocking(_copy_of, get_user, user_id)
 
-def is_admin(user_id: int) -> bool:
-    """Check if user is admin"""
-    admins = get_admins()
-    return str(user_id) in admins
+async def save_user_async(user_id: str, user_data: Dict) -> None:
+    """Save user data"""
+    await run_blocking(save_user, user_id, user_data)
+
+async def get_admins_async() -> Dict:
+    """Get all admins"""
+    return await run_blocking(_copy_of, get_admins)
+
+async def save_admin_async(admin_id: str, admin_data: Dict) -> None:
+    """Save admin data"""
+    await run_blocking(save_admin, admin_id, admin_data)
+
+async def remove_admin_async(admin_id: str) -> bool:
+    """Remove admin by ID"""
+    return await run_blocking(remove_admin, admin_id)
+
+async def get_tests_async() -> Dict:
+    """Get all tests"""
+    return await run_blocking(_copy_of, get_tests)
+
+async def save_test_async(test_data: Dict) -> None:
+    """Save test data"""
+    await run_blocking(save_test, test_data)
+
+async def delete_test_async(age_group: str, test_id: str) -> bool:
+    """Delete test by age group and ID"""
+    return await run_blocking(delete_test, age_group, test_id)
+
+async def has_results_async() -> bool:
+    """Check if any test result is stored"""
+    return await run_blocking(has_results)
+
+async def save_result_async(result_data: Dict) -> None:
+    """Append test result to the results log"""
+    await run_blocking(save_result, result_data)
+
+# 📚 Question index, kept in sync by save_test/delete_test
+class QuestionIndex:
+    """Per age group flat array of question references plus question counts per book"""
+    
+    def __init__(self, tests: Dict):
+        self.questions: Dict[str, Dict] = {}  # "<test_id>:<index>" -> question
+        self.refs: Dict[str, List[tuple]] = {}  # age group -> [(test_id, index), ...]
+        self.book_counts: Dict[str, Dict[str, int]] = {}  # age group -> book name -> count
+        self.test_books: Dict[str, tuple] = {}  # test ID -> (age group, book name)
+        for age_group, age_tests in tests.items():
+            self.refs.setdefault(age_group, [])
+            self.book_counts.setdefault(age_group, {})
+            for test_id, test_data in age_tests.items():
+                self.add_test(test_id, test_data)
+    
+    def add_test(self, test_id: str, test_data: Dict) -> None:
+        age_group = test_data["age_group"]
+        questions = test_data.get('questions', [])
+        for index, question in enumerate(questions):
+            self.questions[f"{test_id}:{index}"] = question
+        self.refs.setdefault(age_group, []).extend((test_id, index) for index in range(len(questions)))
+        book_counts = self.book_counts.setdefault(age_group, {})
+        book_name = test_data.get('book_name', 'Noma\'lum')
+        book_counts[book_name] = book_counts.get(book_name, 0) + len(questions)
+        self.test_books[test_id] = (age_group, book_name)
+    
+    def remove_test(self, test_id: str, test_data: Dict) -> None:
+        age_group = test_data["age_group"]
+        questions = test_data.get('questions', [])
+        for index in range(len(questions)):
+            self.questions.pop(f"{test_id}:{index}", None)
+        # Swap in a new list so concurrent draws never see a half-filtered one
+        self.refs[age_group] = [ref for ref in self.refs.get(age_group, []) if ref[0] != test_id]
+        self.test_books.pop(test_id, None)
+        book_counts = self.book_counts.get(age_group, {})
+        book_name = test_data.get('book_name', 'Noma\'lum')
+        book_counts[book_name] = book_counts.get(book_name, 0) - len(questions)
+        if book_counts[book_name] <= 0:
+            del book_counts[book_name]
+    
+    def count(self, age_group: str) -> int:
+        return len(self.refs.get(age_group, []))
+    
+    def draw(self, age_group: str, k: int) -> List[tuple]:
+        """Pick k distinct random question references, O(k) for large banks"""
+        return random.sample(self.refs.get(age_group, []), k)
+
+_question_index: Optional[QuestionIndex] = None
+
+def _get_question_index() -> QuestionIndex:
+    """Get the question index, building it from tests data on first use"""
+    global _question_index
+    if _question_index is None:
+        with _json_lock:
+            if _question_index is None:
+                _question_index = QuestionIndex(get_tests())
+    return _question_index
+
+def get_question(question_id: str) -> Optional[Dict]:
+    """Get question by ID, None if its test was deleted"""
+    return _get_question_index().questions.get(question_id)
+
+# 🧩 Question payloads: rendered when a test is saved, so sending a question only adds its number
+class QuestionPayloads:
+    """Bounded LRU of question ID -> (HTML question text, answer keyboard)"""
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._payloads: OrderedDict = OrderedDict()
+        # Filled by save_test on storage threads, read on the event loop
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+    
+    @staticmethod
+    def render(question: Dict) -> tuple:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=f"{letter.upper()}) {question[f'option_{letter}']}",
+                                  callback_data=f"answer_{letter}")]
+            for letter in "abcd"
+        ])
+        return html.escape(str(question['question'])), keyboard
+    
+    def _put(self, question_id: str, payload: tuple) -> None:
+        self._payloads[question_id] = payload
+        self._payloads.move_to_end(question_id)
+        while len(self._payloads) > self.max_size:
+            self._payloads.popitem(last=False)
+    
+    def get(self, question_id: str, question: Dict) -> tuple:
+        with self._lock:
+            payload = self._payloads.get(question_id)
+            if payload is not None:
+                self.stats["hits"] += 1
+                self._payloads.move_to_end(question_id)
+                return payload
+            self.stats["misses"] += 1
+        # Evicted, or a test saved before the bot started
+        payload = self.render(question)
+        with self._lock:
+            self._put(question_id, payload)
+        return payload
+    
+    def add_test(self, test_id: str, test_data: Dict) -> None:
+        payloads = [(f"{test_id}:{index}", self.render(question))
+                    for index, question in enumerate(test_data.get('questions', []))]
+        with self._lock:
+            for question_id, payload in payloads:
+                self._put(question_id, payload)
+    
+    def remove_test(self, test_id: str, test_data: Dict) -> None:
+        with self._lock:
+            for index in range(len(test_data.get('questions', []))):
+                self._payloads.pop(f"{test_id}:{index}", None)
+    
+    @property
+    def size(self) -> int:
+        return len(self._payloads)
+
+question_payloads = QuestionPayloads(QUESTION_CACHE_SIZE)
+
+# 👥 Filter indexes: users and results in saving order, with views per region, district and age group
+class FilterIndex:
+    """Ordered references (user IDs, result offsets) per filter, so filtered reads never scan everything"""
+    
+    def __init__(self):
+        self.views: Dict[tuple, List] = {}  # (region, district, age group), None meaning any -> refs
+        self.keys: Dict[Any, tuple] = {}  # ref -> (region, district, age group)
+    
+    @staticmethod
+    def _views_of(key: tuple) -> set:
+        region, district, age_group = key
+        views = set()
+        for age_view in (None, age_group):
+            views.add((None, None, age_view))
+            if region:
+                views.add((region, None, age_view))
+                if district:
+                    views.add((region, district, age_view))
+        return views
+    
+    def add(self, ref: Any, region: Optional[str], district: Optional[str], age_group: Optional[str]) -> None:
+        key = (region, district, age_group)
+        old_key = self.keys.get(ref)
+        if old_key == key:
+            return
+        if old_key:
+            # Saved again with a different region or age: move the ref out of the old views
+            for view in self._views_of(old_key):
+                self.views[view].remove(ref)
+        self.keys[ref] = key
+        for view in self._views_of(key):
+            self.views.setdefault(view, []).append(ref)
+    
+    def refs(self, region: Optional[str] = None, district: Optional[str] = None,
+             age_group: Optional[str] = None) -> List:
+        return self.views.get((region, district, age_group), [])
+    
+    def count(self, region: Optional[str] = None, district: Optional[str] = None,
+              age_group: Optional[str] = None) -> int:
+        return len(self.refs(region, district, age_group))
+    
+    def page(self, offset: int, limit: int, region: Optional[str] = None, district: Optional[str] = None,
+             age_group: Optional[str] = None) -> List:
+        return self.refs(region, district, age_group)[offset:offset + limit]
+
+def _user_age_group(user_data: Dict) -> Optional[str]:
+    try:
+        return get_age_group(user_data.get('age'))
+    except (TypeError, ValueError):
+        return None
+
+def _index_user(index: FilterIndex, user_id: str, user_data: Dict) -> None:
+    index.add(user_id, user_data.get('region'), user_data.get('district'), _user_age_group(user_data))
+
+_user_index: Optional[FilterIndex] = None
+
+def _get_user_index() -> FilterIndex:
+    """Get the user index, building it from users data on first use"""
+    global _user_index
+    if _user_index is None:
+        with _json_lock:
+            if _user_index is None:
+                index = FilterIndex()
+                for user_id, user_data in get_users().items():
+                    _index_user(index, user_id, user_data)
+                _user_index = index
+    return _user_index
+
+# 🔎 Filtered reads: filters are a dict of region, district, age_group, date_from, date_to ("YYYY-MM-DD"),
+# missing or None meaning any
+def _next_day(date: str) -> str:
+    return (datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+def _in_date_range(value: Any, filters: Dict) -> bool:
+    date = str(value or '')[:10]
+    return (not filters.get('date_from') or date >= filters['date_from']) and \
+        (not filters.get('date_to') or date <= filters['date_to'])
+
+def _index_result(index: FilterIndex, ref: int, result: Dict, users: Dict) -> None:
+    # Results saved before region/district were recorded take them from the user
+    user_data = users.get(str(result.get('telegram_id'))) or {}
+    index.add(ref, result.get('region') or user_data.get('region'),
+              result.get('district') or user_data.get('district'), result.get('age_group'))
+
+# JSON backend only: result refs are byte offsets in results.jsonl, or -(n + 1) for the n-th legacy result
+_result_index: Optional[FilterIndex] = None
+
+def _get_result_index() -> FilterIndex:
+    """Get the result index, scanning the results log once on first use"""
+    global _result_index
+    if _result_index is None:
+        with _json_lock:
+            if _result_index is None:
+                index = FilterIndex()
+                users = get_users()
+                legacy_count = 0
+                for cursor, result in _iter_json_results():
+                    if cursor is None:
+                        legacy_count += 1
+                        cursor = -legacy_count
+                    _index_result(index, cursor, result, users)
+                _result_index = index
+    return _result_index
+
+def _read_json_results(refs: Iterable[int]) -> Iterator[Dict]:
+    """Read the results at the given refs, seeking straight to each line"""
+    legacy = load_json_data(RESULTS_FILE, [])
+    with open(RESULTS_LOG_FILE, 'rb') if os.path.exists(RESULTS_LOG_FILE) else BytesIO() as f:
+        for ref in refs:
+            if ref < 0:
+                yield legacy[-ref - 1]
+                continue
+            f.seek(ref)
+            yield json.loads(f.readline())
+
+def filtered_refs(source: str, filters: Dict) -> Optional[List]:
+    """JSON backend: refs of the "results" or "users" matching the place and age filters, from the in-memory
+    indexes of the bot process, so a report worker can read just those rows. None with SQLite, whose indexes
+    every process can query"""
+    if sqlite_storage:
+        return None
+    index = _get_result_index() if source == "results" else _get_user_index()
+    with _json_lock:
+        return list(index.refs(filters.get('region'), filters.get('district'), filters.get('age_group')))
+
+def iter_filtered_results(filters: Dict, refs: Optional[List] = None) -> Iterator[Dict]:
+    """Results matching the filters, oldest first; reads only the matching results"""
+    if sqlite_storage:
+        yield from sqlite_storage.query_results(filters)
+        return
+    if refs is None:
+        refs = filtered_refs("results", filters)
+    for result in _read_json_results(refs):
+        if _in_date_range(result.get('date'), filters):
+            yield result
+
+def iter_filtered_users(filters: Dict, refs: Optional[List] = None) -> Iterator[tuple]:
+    """(user ID, user data) pairs matching the filters, in registration order"""
+    if sqlite_storage:
+        yield from sqlite_storage.query_users(filters)
+        return
+    if refs is None:
+        refs = filtered_refs("users", filters)
+    user_ids = refs
+    with _json_lock:
+        users = get_users()
+    for user_id in user_ids:
+        user_data = users.get(user_id)
+        if user_data and _in_date_range(user_data.get('registration_date'), filters):
+            yield user_id, user_data
+
+# 📈 Result aggregates: counters over all results, updated as each result is saved and stored with the
+# results version they include, so a restart only reads the results saved after that version
+def _results_since(version: List) -> Optional[Iterator[Dict]]:
+    """Results saved after a get_results_version() value, None if results were rewritten since"""
+    current = json.loads(json.dumps(get_results_version()))
+    if version[:2] != current[:2] or version[2] > current[2]:
+        return None
+    # JSON positions are the log size (where the next result starts), SQLite positions the last row ID
+    cursor = version[2] + 1 if current[0] == "sqlite" else version[2]
+    return (result for _, result in iter_results_from(cursor))
+
+class ResultAggregate(ABC):
+    """Base for counters kept over all results; subclasses set file_path and implement empty() and add()"""
+    file_path = ""
+    # Bump in a subclass when its stored layout changes so it is rebuilt from the results
+    FORMAT = 1
+    
+    def __init__(self):
+        self.data: Optional[Dict] = None  # None until load(), e.g. in report worker processes
+    
+    @abstractmethod
+    def empty(self) -> Dict:
+        """Stored data of an aggregate over no results"""
+    
+    @abstractmethod
+    def add(self, result: Dict) -> None:
+        """Count one result into self.data"""
+    
+    def matches(self, data: Dict) -> bool:
+        """Whether stored data was built with the current settings"""
+        return data.get("format") == self.FORMAT
+    
+    def load(self) -> None:
+        """Load stored counters and add the results saved since, rebuilding them if that's not possible"""
+        with _json_lock:
+            data = load_json_data(self.file_path, {})
+            new_results = _results_since(data["version"]) if self.matches(data) else None
+            if new_results is None:
+                data, new_results = {"format": self.FORMAT, "version": None, **self.empty()}, get_results()
+            version = json.loads(json.dumps(get_results_version()))
+            self.data = data
+            for result in new_results:
+                self.add(result)
+            if data["version"] != version:
+                data["version"] = version
+                save_json_data(self.file_path, data)
+    
+    def record(self, result: Dict, version: List) -> None:
+        """Add a result that was just saved; the caller holds _json_lock"""
+        if self.data is None:
+            return
+        self.add(result)
+        self.data["version"] = version
+        save_json_data(self.file_path, self.data)
+
+def _record_result(result_data: Dict) -> None:
+    """Update the result aggregates with a saved result; the caller holds _json_lock"""
+    if not any(aggregate.data is not None for aggregate in RESULT_AGGREGATES):
+        return
+    version = json.loads(json.dumps(get_results_version()))
+    for aggregate in RESULT_AGGREGATES:
+        aggregate.record(result_data, version)
+
+# Per question: [attempts, correct, timeouts, A, B, C, D]
+CHOICE_COLUMNS = {"a": 3, "b": 4, "c": 5, "d": 6}
+
+class QuestionStats(ResultAggregate):
+    """Answer counters per question ID, for spotting the hardest and most skipped questions"""
+    file_path = QUESTION_STATS_FILE
+    
+    def empty(self) -> Dict:
+        return {"questions": {}}
+    
+    def add(self, result: Dict) -> None:
+        questions = self.data["questions"]
+        for answer in result.get('answers') or []:
+            question_id = answer.get('question_id')
+            if not question_id:
+                # Results saved before answers recorded their question
+                continue
+            counts = questions.get(question_id)
+            if counts is None:
+                counts = questions[question_id] = [0] * 7
+            counts[0] += 1
+            if answer.get('correct'):
+                counts[1] += 1
+            choice = answer.get('answer')
+            if choice is None:
+                counts[2] += 1
+            elif choice in CHOICE_COLUMNS:
+                counts[CHOICE_COLUMNS[choice]] += 1
+    
+    def by_book(self) -> Dict[tuple, List[tuple]]:
+        """(age group, book name) -> [(question ID, question, counts), ...] for questions of existing tests"""
+        question_index = _get_question_index()
+        books: Dict[tuple, List[tuple]] = {}
+        with _json_lock:
+            for question_id, counts in (self.data or {}).get("questions", {}).items():
+                question = question_index.questions.get(question_id)
+                if question is None:
+                    continue
+                book = question_index.test_books[question_id.rsplit(":", 1)[0]]
+                books.setdefault(book, []).append((question_id, question, list(counts)))
+        return books
+
+def _duration_seconds(time_taken: Any) -> int:
+    """Seconds in a time_taken string such as "0:05:12" or "1 day, 0:05:12"; unknown durations rank last"""
+    try:
+        days, _, clock = str(time_taken).rpartition(", ")
+        hours, minutes, seconds = (int(part) for part in clock.split(":"))
+    except ValueError:
+        return sys.maxsize
+    return (int(days.split()[0]) * 86400 if days else 0) + hours * 3600 + minutes * 60 + seconds
 
-def is_super_admin(user_id: int) -> bool:
-    """Check if user is super admin"""
-    admins = get_admins()
-    return str(user_id) in admins and admins[str(user_id)].get("role") == "super_admin"
+def _leaderboard_key(region: Optional[str], district: Optional[str], age_group: Optional[str]) -> str:
+    return f"{region or ''}|{district or ''}|{age_group or ''}"
+
+def _leaderboard_rank(entry: List) -> tuple:
+    # Higher score first, then less time, then the earlier result
+    return -entry[0], entry[1], entry[2]
+
+class Leaderboards(ResultAggregate):
+    """Best result per user on sorted top LEADERBOARD_SIZE lists per region, district and age group.
+    
+    Entries are [score, seconds, date, user ID, name, time taken]. A user's best result only improves and
+    drops off a board only when LEADERBOARD_SIZE others are better, so the boards stay exact.
+    """
+    file_path = LEADERBOARDS_FILE
+    
+    def empty(self) -> Dict:
+        return {"size": LEADERBOARD_SIZE, "boards": {}}
+    
+    def matches(self, data: Dict) -> bool:
+        return super().matches(data) and data.get("size") == LEADERBOARD_SIZE
+    
+    def add(self, result: Dict) -> None:
+        user_id = result.get('telegram_id', result.get('user_id'))
+        if user_id is None:
+            return
+        region, district = result.get('region'), result.get('district')
+        if region is None:
+            # Results saved before they recorded the region: use the user's
+            user_data = get_user(str(user_id)) or {}
+            region, district = user_data.get('region'), user_data.get('district')
+        entry = [result.get('score', 0), _duration_seconds(result.get('time_taken')), result.get('date', ''),
+                 str(user_id), result.get('user_name', 'N/A'), result.get('time_taken', 'N/A')]
+        
+        boards = self.data["boards"]
+        places = [(None, None)] + ([(region, None)] + ([(region, district)] if district else []) if region else [])
+        for place_region, place_district in places:
+            for age_group in (None, result.get('age_group')):
+                key = _leaderboard_key(place_region, place_district, age_group)
+                board = boards.get(key)
+                if board is None:
+                    board = boards[key] = []
+                self._offer(board, entry)
+    
+    @staticmethod
+    def _offer(board: List[List], entry: List) -> None:
+        """Put a result on a board if it beats the user's entry there and makes the top"""
+        rank = _leaderboard_rank(entry)
+        for i, current in enumerate(board):
+            if current[3] == entry[3]:
+                if rank >= _leaderboard_rank(current):
+                    return
+                del board[i]
+                break
+        else:
+            if len(board) >= LEADERBOARD_SIZE and rank >= _leaderboard_rank(board[-1]):
+                return
+        position = next((i for i, current in enumerate(board) if rank < _leaderboard_rank(current)), len(board))
+        board.insert(position, entry)
+        del board[LEADERBOARD_SIZE:]
+    
+    def top(self, region: Optional[str] = None, district: Optional[str] = None,
+            age_group: Optional[str] = None) -> List[List]:
+        """Copy of one board, best first"""
+        with _json_lock:
+            return [list(entry) for entry in (self.data or {}).get("boards", {}).get(
+                _leaderboard_key(region, district, age_group), [])]
+
+question_stats = QuestionStats()
+leaderboards = Leaderboards()
+RESULT_AGGREGATES: List[ResultAggregate] = [question_stats, leaderboards]
+
+# 💾 Persistent FSM storage
+class SQLiteFSMStorage(BaseStorage):
+    """FSM storage served from memory and persisted to SQLite so sessions survive restarts"""
+    
+    def __init__(self, db_path: str):
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL)")
+        # Only non-empty records are stored, so a missing key means no state and no data
+        self.records: Dict[str, tuple] = {
+            key: (state, json.loads(data))
+            for key, state, data in self.conn.execute("SELECT key, state, data FROM fsm")
+        }
+        self._dirty: set = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.closed = False
+    
+    def _put(self, key: str, state: Optional[str], data: Dict) -> None:
+        if state is None and not data:
+            self.records.pop(key, None)
+        else:
+            self.records[key] = (state, data)
+        self._dirty.add(key)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+    
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(FSM_SAVE_DELAY)
+        self._flush_task = None
+        await self.flush()
+    
+    async def flush(self) -> None:
+        """Write changed records to the database"""
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for key in keys:
+            record = self.records.get(key)
+            if record is None:
+                deletes.append((key,))
+            else:
+                upserts.append((key, record[0], json.dumps(record[1], ensure_ascii=False, separators=(',', ':'))))
+        await run_blocking(self._write, upserts, deletes)
+    
+    def _write(self, upserts: List[tuple], deletes: List[tuple]) -> None:
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO fsm VALUES (?, ?, ?)", upserts)
+            self.conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+    
+    async def set_state(self, key: StorageKey, state: Any = None) -> None:
+        storage_key = self.key_builder.build(key)
+        state = state.state if isinstance(state, State) else state
+        self._put(storage_key, state, self.records.get(storage_key, (None, {}))[1])
+    
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self.records.get(self.key_builder.build(key), (None, {}))[0]
+    
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        storage_key = self.key_builder.build(key)
+        self._put(storage_key, self.records.get(storage_key, (None, {}))[0], data.copy())
+    
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self.records.get(self.key_builder.build(key), (None, {}))[1].copy()
+    
+    def sessions_in_state(self, bot_id: int, state: State) -> Iterator[tuple]:
+        """(user ID, data) of the private chats of a bot that are in a state"""
+        for key, (record_state, data) in list(self.records.items()):
+            # Keys are "fsm:<bot ID>:<chat ID>:<user ID>:<destiny>"
+            parts = key.split(self.key_builder.separator)
+            if record_state == state.state and len(parts) == 5 and parts[1] == str(bot_id) and parts[2] == parts[3]:
+                yield int(parts[3]), data
+    
+    async def close(self) -> None:
+        """Write pending changes and close the database; later calls do nothing"""
+        if self.closed:
+            return
+        self.closed = True
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        self.conn.close()
+
+# 🤖 Bot and Dispatcher
+bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+dp = Dispatcher(storage=SQLiteFSMStorage(FSM_DB_FILE))
+
+# 👮 Role index: admin ID -> role, loaded once and kept in sync by save_admin/remove_admin
+_role_index: Optional[Dict[str, str]] = None
+
+def _get_role_index() -> Dict[str, str]:
+    """Get the role index, loading it from admins data on first use"""
+    global _role_index
+    if _role_index is None:
+        with _json_lock:
+            if _role_index is None:
+                _role_index = {admin_id: admin_data.get("role", "admin")
+                               for admin_id, admin_data in get_admins().items()}
+    return _role_index
+
+def get_role(user_id: int) -> Optional[str]:
+    """Get user's admin role ("super_admin", "admin") or None"""
+    return _get_role_index().get(str(user_id))
+
+# 👤 Admin profiles: admin ID -> display name and username, refreshed after ADMIN_PROFILE_TTL
+class AdminProfiles:
+    """Cached admin names for admin lists; misses are fetched concurrently with bounded parallelism"""
+    
+    def __init__(self):
+        self._profiles: Dict[str, tuple] = {}  # admin ID -> (full name, username, monotonic expiry time)
+        self._semaphore = asyncio.Semaphore(ADMIN_PROFILE_CONCURRENCY)
+    
+    def remember(self, admin_id, full_name: Optional[str], username: Optional[str]) -> None:
+        self._profiles[str(admin_id)] = (full_name, username, time.monotonic() + ADMIN_PROFILE_TTL)
+    
+    def remember_user(self, user: types.User) -> None:
+        """Refresh a profile from an update sent by the admin; free, since Telegram already sent it"""
+        cached = self._profiles.get(str(user.id))
+        if not cached or cached[:2] != (user.full_name, user.username):
+            self.remember(user.id, user.full_name, user.username)
+    
+    def forget(self, admin_id) -> None:
+        self._profiles.pop(str(admin_id), None)
+    
+    def display(self, admin_id) -> tuple:
+        """(full name, @username) with the usual placeholders for unknown values"""
+        full_name, username, _ = self._profiles.get(str(admin_id), (None, None, 0))
+        return full_name or 'Ism korsatilmagan', f"@{username}" if username else 'Username yoq'
+    
+    async def load(self, admin_ids: Iterable[str]) -> None:
+        """Make sure the given profiles are cached, fetching missing or stale ones in one concurrent round"""
+        now = time.monotonic()
+        stale = [admin_id for admin_id in admin_ids
+                 if self._profiles.get(str(admin_id), (None, None, 0))[2] <= now]
+        if stale:
+            await asyncio.gather(*(self._fetch(admin_id) for admin_id in stale))
+    
+    async def _fetch(self, admin_id) -> None:
+        async with self._semaphore:
+            try:
+                chat = await bot.get_chat(int(admin_id))
+            except (TelegramAPIError, asyncio.TimeoutError, OSError, ValueError) as e:
+                logging.warning(f"Could not fetch profile of admin {admin_id}: {e}")
+                # Keep whatever we knew, but try again sooner than a normal refresh
+                full_name, username, _ = self._profiles.get(str(admin_id), (None, None, 0))
+                self._profiles[str(admin_id)] = (full_name, username, time.monotonic() + ADMIN_PROFILE_RETRY)
+                return
+        self.remember(admin_id, chat.full_name, chat.username)
+
+admin_profiles = AdminProfiles()
+
+class RoleMiddleware(BaseMiddleware):
+    """Resolve the sender's admin role once per update and pass it to handlers as `role`"""
+    
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        data["role"] = get_role(user.id) if user else None
+        if data["role"]:
+            admin_profiles.remember_user(user)
+        return await handler(event, data)
+
+dp.update.outer_middleware(RoleMiddleware())
+
+# ⏰ Question deadlines
+class DeadlineScheduler:
+    """One task owning all question deadlines: a heap with lazy cancellation, one pending deadline per key"""
+    
+    def __init__(self, callback):
+        self._callback = callback
+        self._heap: List[list] = []  # [deadline, seq, key, payload, active]
+        self._entries: Dict[Any, list] = {}
+        self._seq = itertools.count()
+        self._cancelled = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def pending(self) -> int:
+        """Number of pending deadlines"""
+        return len(self._entries)
+    
+    def schedule(self, key: Any, delay: float, payload: Any = None) -> None:
+        """Call callback(key, payload) after delay seconds, replacing key's pending deadline"""
+        self.cancel(key)
+        deadline = asyncio.get_running_loop().time() + delay
+        entry = [deadline, next(self._seq), key, payload, True]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._wakeup.set()
+    
+    def cancel(self, key: Any) -> bool:
+        """Cancel key's pending deadline"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        entry[-1] = False
+        self._cancelled += 1
+        # Drop cancelled entries once they make up most of the heap
+        if self._cancelled > 64 and self._cancelled * 2 > len(self._heap):
+            self._heap = [e for e in self._heap if e[-1]]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+        return True
+    
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+    
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            while self._heap and not self._heap[0][-1]:
+                heapq.heappop(self._heap)
+                self._cancelled -= 1
+            
+            if not self._heap:
+                timeout = None
+            else:
+                timeout = self._heap[0][0] - loop.time()
+                if timeout <= 0:
+                    _, _, key, payload, _ = heapq.heappop(self._heap)
+                    del self._entries[key]
+                    asyncio.create_task(self._callback(key, payload))
+                    continue
+            
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+question_deadlines = DeadlineScheduler(lambda user_id, question_num: on_question_timeout(user_id, question_num))
+
+# 📣 Admin notifications
+class NotificationDigest:
+    """Running summary of admin events collected while digest mode is active"""
+    
+    def __init__(self):
+        self.started = datetime.now()
+        self.registrations = 0
+        self.regions: Counter = Counter()
+        self.results = 0
+        self.score_sum = 0
+        self.top_results: List[tuple] = []  # min-heap of (score, seq, name, time_taken)
+        self.feedback: List[tuple] = []  # (name, text), first DIGEST_TABLE_ROWS only
+        self.feedback_count = 0
+        self._seq = itertools.count()
+    
+    @property
+    def total(self) -> int:
+        return self.registrations + self.results + self.feedback_count
+    
+    def add(self, kind: str, details: Dict[str, Any]) -> None:
+        if kind == "registration":
+            self.registrations += 1
+            self.regions[details.get('region', 'N/A')] += 1
+        elif kind == "result":
+            self.results += 1
+            self.score_sum += details['score']
+            entry = (details['score'], next(self._seq), details.get('name', 'N/A'), details.get('time_taken', ''))
+            if len(self.top_results) < DIGEST_TABLE_ROWS:
+                heapq.heappush(self.top_results, entry)
+            elif entry[0] > self.top_results[0][0]:
+                heapq.heapreplace(self.top_results, entry)
+        elif kind == "feedback":
+            self.feedback_count += 1
+            if len(self.feedback) < DIGEST_TABLE_ROWS:
+                self.feedback.append((details.get('name', 'N/A'), details.get('text', '')))
+    
+    def render(self) -> str:
+        lines = [
+            f"🗂 Xulosa ({self.started.strftime('%H:%M')} - {datetime.now().strftime('%H:%M')}):",
+            f"📋 Yangi ro'yxatdan o'tishlar: {self.registrations}",
+        ]
+        if self.results:
+            lines.append(f"📊 Test natijalari: {self.results}, o'rtacha ball: {round(self.score_sum / self.results)}")
+        else:
+            lines.append("📊 Test natijalari: 0")
+        lines.append(f"💬 Fikrlar: {self.feedback_count}")
+        
+        if self.regions:
+            lines.append("\n🌍 Viloyatlar bo'yicha:")
+            for region, count in self.regions.most_common(DIGEST_TABLE_ROWS):
+                lines.append(f"{html.escape(str(region))} — {count}")
+        if self.top_results:
+            lines.append("\n🏆 Eng yaxshi natijalar:")
+            for i, (score, _, name, time_taken) in enumerate(sorted(self.top_results, reverse=True), 1):
+                lines.append(f"{i}. {html.escape(str(name))} — {score} ({time_taken})")
+        if self.feedback:
+            lines.append("\n💭 Fikrlar:")
+            for name, text in self.feedback:
+                lines.append(f"• {html.escape(str(name))}: {html.escape(str(text)[:100])}")
+            if self.feedback_count > len(self.feedback):
+                lines.append(f"... va yana {self.feedback_count - len(self.feedback)} ta")
+        # Stay within Telegram's message size limit, cutting between lines so no HTML entity is split
+        text_length = 0
+        for i, line in enumerate(lines):
+            text_length += len(line) + 1
+            if text_length > 3990:
+                return "\n".join(lines[:i] + ["..."])
+        return "\n".join(lines)
+
+class AdminNotifier:
+    """Queue that delivers admin notifications concurrently within Telegram's rate limits"""
+    
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._next_global = 0.0  # loop time of the next free global send slot
+        self._next_chat: Dict[int, float] = {}  # chat ID -> loop time of its next free slot
+        self.stats = {"sent": 0, "retried": 0, "failed": 0}
+        self._recent: deque = deque()  # monotonic times of recent events, for auto digest mode
+        self._digest_mode = False
+        self._digest = NotificationDigest()
+        self._digest_task: Optional[asyncio.Task] = None
+    
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+    
+    @property
+    def digest_active(self) -> bool:
+        return self._digest_task is not None
+    
+    @property
+    def digest_pending(self) -> int:
+        return self._digest.total
+    
+    def notify_admins(self, text: str) -> None:
+        """Queue a message for every admin without waiting for delivery"""
+        for admin_id in list(_get_role_index()):
+            self._queue.put_nowait((int(admin_id), text))
+    
+    def notify_event(self, kind: str, text: str, details: Dict[str, Any]) -> None:
+        """Send an event (registration/result/feedback) now, or fold it into the digest when busy"""
+        self._recent.append(time.monotonic())
+        if not self._update_digest_mode():
+            self.notify_admins(text)
+            return
+        
+        self._digest.add(kind, details)
+        if self._digest_task is None:
+            self._digest_task = asyncio.create_task(self._digest_loop())
+    
+    def _update_digest_mode(self) -> bool:
+        """Record the current event rate and return whether events should go into the digest"""
+        if NOTIFY_DIGEST == "on":
+            return True
+        if NOTIFY_DIGEST != "auto":
+            return False
+        
+        cutoff = time.monotonic() - DIGEST_INTERVAL
+        while self._recent and self._recent[0] < cutoff:
+            self._recent.popleft()
+        # Switch back to real time only once traffic is well below the threshold, so the mode doesn't flap
+        if self._digest_mode:
+            self._digest_mode = len(self._recent) >= DIGEST_THRESHOLD // 2
+        else:
+            self._digest_mode = len(self._recent) > DIGEST_THRESHOLD
+        return self._digest_mode
+    
+    async def _digest_loop(self) -> None:
+        try:
+            while True:
+                await asyncio.sleep(DIGEST_INTERVAL)
+                self.flush_digest()
+                if not self._update_digest_mode():
+                    break
+        finally:
+            self._digest_task = None
+    
+    def flush_digest(self) -> None:
+        """Send the buffered events as one summary message per admin"""
+        if self._digest.total:
+            self.notify_admins(self._digest.render())
+            self._digest = NotificationDigest()
+    
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(NOTIFY_CONCURRENCY)]
+    
+    async def stop(self, timeout: float = 5) -> None:
+        """Give queued messages a moment to go out, then stop the workers"""
+        if self._digest_task:
+            self._digest_task.cancel()
+        self.flush_digest()
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Dropping {self.queued} undelivered admin notifications")
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+    
+    async def _wait_for_slot(self, chat_id: int) -> None:
+        """Reserve the next send slot allowed by the global and per-chat limits"""
+        loop = asyncio.get_running_loop()
+        chat_slot = max(loop.time(), self._next_chat.get(chat_id, 0.0))
+        self._next_chat[chat_id] = chat_slot + NOTIFY_CHAT_INTERVAL
+        await asyncio.sleep(chat_slot - loop.time())
+        
+        # Take a global slot only once the chat is ready, so one busy chat doesn't hold up the others
+        global_slot = max(loop.time(), self._next_global)
+        self._next_global = global_slot + 1 / NOTIFY_GLOBAL_RATE
+        await asyncio.sleep(global_slot - loop.time())
+    
+    async def _worker(self) -> None:
+        while True:
+            chat_id, text = await self._queue.get()
+            try:
+                await self._deliver(chat_id, text)
+            finally:
+                self._queue.task_done()
+    
+    async def _deliver(self, chat_id: int, text: str) -> None:
+        for attempt in range(NOTIFY_MAX_RETRIES + 1):
+            await self._wait_for_slot(chat_id)
+            try:
+                await bot.send_message(chat_id, text)
+                self.stats["sent"] += 1
+                return
+            except TelegramRetryAfter as e:
+                # Flood wait: hold back every send until Telegram allows it again
+                self.stats["retried"] += 1
+                loop = asyncio.get_running_loop()
+                self._next_global = max(self._next_global, loop.time() + e.retry_after)
+                logging.warning(f"Flood wait {e.retry_after}s while notifying admin {chat_id}")
+            except (TelegramAPIError, asyncio.TimeoutError, OSError) as e:
+                self.stats["failed"] += 1
+                logging.error(f"Error sending message to admin {chat_id}: {e}")
+                return
+        
+        self.stats["failed"] += 1
+        logging.error(f"Giving up on notifying admin {chat_id} after {NOTIFY_MAX_RETRIES} retries")
+
+admin_notifier = AdminNotifier()
+
+# 📌 Channel subscription cache
+class SubscriptionCache:
+    """Channel subscription status per user, cached with separate TTLs for both answers"""
+    
+    def __init__(self):
+        self._entries: Dict[int, tuple] = {}  # user ID -> (subscribed, monotonic expiry time)
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self._prune_at = 1000
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"hits": 0, "misses": 0, "errors": 0, "rechecked": 0}
+    
+    @property
+    def size(self) -> int:
+        return len(self._entries)
+    
+    async def is_subscribed(self, user_id: int, refresh: bool = False) -> Optional[bool]:
+        """Cached subscription status; refresh=True always asks Telegram.
+        None when Telegram can't be asked and there is no earlier answer"""
+        entry = self._entries.get(user_id)
+        if entry and not refresh and entry[1] > time.monotonic():
+            self.stats["hits"] += 1
+            return entry[0]
+        
+        self.stats["misses"] += 1
+        # Concurrent checks for the same user share one request
+        future = self._inflight.get(user_id)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(user_id))
+            self._inflight[user_id] = future
+            future.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        return await asyncio.shield(future)
+    
+    async def _fetch(self, user_id: int) -> Optional[bool]:
+        try:
+            chat_member = await bot.get_chat_member(chat_id=CHANNEL_USERNAME, user_id=user_id)
+        except (TelegramAPIError, asyncio.TimeoutError, OSError) as e:
+            self.stats["errors"] += 1
+            logging.error(f"Error checking subscription: {e}")
+            # Fall back to the last known status; users never checked before have to try again
+            entry = self._entries.get(user_id)
+            return entry[0] if entry else None
+        
+        subscribed = chat_member.status in ("member", "administrator", "creator")
+        ttl = SUB_CACHE_TTL if subscribed else SUB_CACHE_NEGATIVE_TTL
+        self._entries[user_id] = (subscribed, time.monotonic() + ttl)
+        if len(self._entries) > self._prune_at:
+            self._prune()
+        return subscribed
+    
+    def _prune(self) -> None:
+        """Drop expired entries"""
+        now = time.monotonic()
+        for user_id in [user_id for user_id, (_, expires) in self._entries.items() if expires <= now]:
+            del self._entries[user_id]
+        self._prune_at = max(1000, len(self._entries) * 2)
+    
+    def start(self) -> None:
+        if SUB_RECHECK_INTERVAL > 0 and self._task is None:
+            self._task = asyncio.create_task(self._recheck_loop())
+    
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _recheck_loop(self) -> None:
+        """Re-verify subscribed users whose entries would expire before the next pass"""
+        while True:
+            await asyncio.sleep(SUB_RECHECK_INTERVAL)
+            self._prune()
+            horizon = time.monotonic() + SUB_RECHECK_INTERVAL
+            due = [user_id for user_id, (subscribed, expires) in self._entries.items()
+                   if subscribed and expires <= horizon]
+            for i in range(0, len(due), SUB_RECHECK_BATCH):
+                batch = due[i:i + SUB_RECHECK_BATCH]
+                await asyncio.gather(*(self.is_subscribed(user_id, refresh=True) for user_id in batch))
+                self.stats["rechecked"] += len(batch)
+                await asyncio.sleep(len(batch) / SUB_RECHECK_RATE)
+
+subscription_cache = SubscriptionCache()
 
 # 📌 FSM States
 class Registration(StatesGroup):
@@ -180,6 +1921,11 @@ class AdminStates(StatesGroup):
     add_test_questions = State()
     delete_test_age = State()
     delete_test_select = State()
+    report_source = State()
+    report_region = State()
+    report_district = State()
+    report_age = State()
+    report_dates = State()
 
 class TestStates(StatesGroup):
     taking_test = State()
@@ -210,7 +1956,9 @@ def get_admin_menu(is_super: bool = False):
             [KeyboardButton(text="➖ Admin o'chirish")],
             [KeyboardButton(text="🗑 Test o'chirish")],
             [KeyboardButton(text="📊 Test natijalarini yuklab olish")],
-            [KeyboardButton(text="📋 Foydalanuvchi ma'lumotlarini yuklab olish")]
+            [KeyboardButton(text="📋 Foydalanuvchi ma'lumotlarini yuklab olish")],
+            [KeyboardButton(text="🔎 Filtrlangan hisobot")],
+            [KeyboardButton(text="📦 Xom ma'lumotlar (CSV/NDJSON)")]
         ])
     
     keyboard.append([KeyboardButton(text="🔙 Asosiy menyu")])
@@ -225,135 +1973,216 @@ def get_age_group_keyboard():
     ], resize_keyboard=True)
 
 # 📌 PDF and Excel generation functions
-def generate_pdf_report(results: List[Dict]) -> bytes:
-    """Generate PDF report of test results"""
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    styles = getSampleStyleSheet()
-    
-    # Title
-    title = Paragraph("KITOBXON KIDS - Test Natijalari", styles['Title'])
-    
-    # Create table data
-    table_data = [['Foydalanuvchi', 'Yosh', 'Ball', 'Vaqt', 'Foiz', 'Sana']]
-    
-    for result in results:
-        table_data.append([
-            result.get('user_name', 'N/A'),
-            result.get('age', 'N/A'),
-            f"{result.get('score', 0)}/100",
-            result.get('time_taken', 'N/A'),
-            f"{result.get('percentage', 0)}%",
-            result.get('date', 'N/A')
-        ])
-    
-    # Create table
-    table = Table(table_data)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 14),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    # Build PDF
-    doc.build([title, table])
-    buffer.seek(0)
-    return buffer.getvalue()
+def _pdf_cell(value: Any, width: float, style) -> Any:
+    """Plain string for short values; Paragraph (slow to lay out) only when the text must wrap"""
+    text = str(value)
+    # Roughly how many characters fit on one line of the column
+    if len(text) * style.fontSize * 0.5 <= width:
+        return text
+    return Paragraph(html.escape(text), style)
 
-def generate_users_pdf_report(users_data: Dict) -> bytes:
-    """Generate PDF report of registered users"""
-    buffer = BytesIO()
-    # Use landscape orientation and larger page size for more space
-    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4))
-    styles = getSampleStyleSheet()
-    
-    # Title
-    title = Paragraph("KITOBXON KIDS - Ro'yxatdan o'tgan foydalanuvchilar", styles['Title'])
-    
-    # Create table data with wrapped text
-    table_data = [['Farzand nomi', 'Ota-ona', 'Yosh', 'Viloyat', 'Tuman', 'Telegram ID', 'Username', 'Telefon', 'Ro\'yxat sanasi']]
-    
-    for user_id, user_data in users_data.items():
-        username = user_data.get('username', 'N/A')
-        if username != 'N/A' and not username.startswith('@'):
-            username = f"@{username}"
-        
-        # Wrap long text in Paragraphs for better display
-        child_name = Paragraph(user_data.get('child_name', 'N/A'), styles['Normal'])
-        parent_name = Paragraph(user_data.get('parent_name', 'N/A'), styles['Normal'])
-        region = Paragraph(user_data.get('region', 'N/A'), styles['Normal'])
-        district = Paragraph(user_data.get('district', 'N/A'), styles['Normal'])
-        username_p = Paragraph(username, styles['Normal'])
-        phone = Paragraph(user_data.get('phone', 'N/A'), styles['Normal'])
-        
-        table_data.append([
-            child_name,
-            parent_name,
-            user_data.get('age', 'N/A'),
-            region,
-            district,
-            user_id,
-            username_p,
-            phone,
-            user_data.get('registration_date', 'N/A')[:10] if user_data.get('registration_date') else 'N/A'
-        ])
-    
-    # Create table with specific column widths
-    col_widths = [80, 80, 35, 70, 70, 60, 70, 70, 65]  # Adjusted widths
-    table = Table(table_data, colWidths=col_widths)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+def _pdf_table_style(header_font_size: int, cell_font_size: int, header: bool = True, odd: bool = False) -> TableStyle:
+    """Table style of one chunk of a report; rows are colored by ROWBACKGROUNDS, not per-row commands.
+    Chunks that continue a page have no header row, and odd ones keep the stripes going from the previous chunk"""
+    first = 1 if header else 0
+    stripes = [colors.beige, colors.lightgrey]
+    commands = [
         ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
         ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 9),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('TOPPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 7),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.beige, colors.lightgrey]),
+        ('FONTSIZE', (0, first), (-1, -1), cell_font_size),
         ('LEFTPADDING', (0, 0), (-1, -1), 4),
         ('RIGHTPADDING', (0, 0), (-1, -1), 4),
-        ('TOPPADDING', (0, 1), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 1), (-1, -1), 8),
-    ]))
-    
-    # Build PDF
-    doc.build([title, table])
-    buffer.seek(0)
+        ('ROWBACKGROUNDS', (0, first), (-1, -1), stripes[::-1] if odd else stripes),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+    ]
+    if header:
+        commands += [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), header_font_size),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+            ('TOPPADDING', (0, 0), (-1, 0), 8),
+        ]
+    return TableStyle(commands)
+
+def _build_pdf_files(title: str, headers: List[str], rows: Iterable[List], col_widths: List[float], pagesize,
+                     font_sizes: tuple, max_rows: int = PDF_MAX_ROWS, first_part: int = 1) -> List[bytes]:
+    """Lay rows out as small Tables of PDF_CHUNK_ROWS rows, starting a new file every max_rows rows.
+    Chunks are measured and cut at page ends, so the header row is only at the top of each page.
+    
+    first_part > 1 continues a split report whose earlier files were kept.
+    """
+    header_font_size, cell_font_size = font_sizes
+    styles = getSampleStyleSheet()
+    cell_style = ParagraphStyle('cell', parent=styles['Normal'], fontSize=cell_font_size, leading=cell_font_size + 2)
+    doc_template = SimpleDocTemplate(BytesIO(), pagesize=pagesize)
+    # The frame has 6 pt padding on each side; 1 pt more absorbs rounding
+    frame_width, frame_height = doc_template.width - 12, doc_template.height - 13
+    files = []
+    story: List = []
+    chunk: List[List] = []
+    file_rows = 0
+    page = {"left": 0.0, "top": True, "rows": 0}
+    
+    def make_table(rows: List[List]) -> Table:
+        header = page["top"]
+        return Table([headers] + rows if header else rows, colWidths=col_widths, repeatRows=1 if header else 0,
+                     style=_pdf_table_style(header_font_size, cell_font_size, header, page["rows"] % 2 == 1))
+    
+    def start_file():
+        # Measured with a part number, in case the report is split later
+        part_title = Paragraph(f"{title} ({len(files) + first_part}-qism)", styles['Title'])
+        page.update(left=frame_height - part_title.wrap(frame_width, frame_height)[1] - part_title.getSpaceAfter(),
+                    top=True, rows=0)
+    
+    def new_page():
+        story.append(PageBreak())
+        page.update(left=frame_height, top=True, rows=0)
+    
+    def add_chunk():
+        while chunk:
+            table = make_table(chunk)
+            table.wrap(frame_width, frame_height)
+            heights = table._rowHeights
+            if sum(heights) <= page["left"]:
+                story.append(table)
+                page.update(left=page["left"] - sum(heights), top=False, rows=page["rows"] + len(chunk))
+                chunk.clear()
+                return
+            # Rows up to the end of the page, then the rest goes on the next page under a new header
+            skip = 1 if page["top"] else 0
+            used, fit = sum(heights[:skip]), 0
+            for height in heights[skip:]:
+                if used + height > page["left"]:
+                    break
+                used += height
+                fit += 1
+            if fit == 0 and page["top"]:
+                fit = 1  # A row taller than a page is left to reportlab to split
+            if fit:
+                story.append(make_table(chunk[:fit]))
+                del chunk[:fit]
+            new_page()
+    
+    def build_file(part: Optional[int]):
+        if chunk:
+            add_chunk()
+        buffer = BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=pagesize)
+        part_title = f"{title} ({part}-qism)" if part else title
+        doc.build([Paragraph(part_title, styles['Title'])] + story)
+        files.append(buffer.getvalue())
+        story.clear()
+    
+    start_file()
+    for row in rows:
+        # Start the next file only once there is a row for it
+        if max_rows and file_rows == max_rows:
+            build_file(len(files) + first_part)
+            start_file()
+            file_rows = 0
+        chunk.append([_pdf_cell(value, width, cell_style) for value, width in zip(row, col_widths)])
+        file_rows += 1
+        if len(chunk) >= PDF_CHUNK_ROWS:
+            add_chunk()
+    
+    build_file(len(files) + first_part if files or first_part > 1 else None)
+    return files
+
+def generate_pdf_report(results: Iterable[Dict], max_rows: int = PDF_MAX_ROWS, first_part: int = 1) -> List[bytes]:
+    """Generate PDF report of test results, split into several files above max_rows results"""
+    headers = ['Foydalanuvchi', 'Yosh', 'Ball', 'Vaqt', 'Foiz', 'Sana']
+    rows = ([
+        result.get('user_name', 'N/A'),
+        result.get('age', 'N/A'),
+        f"{result.get('score', 0)}/100",
+        result.get('time_taken', 'N/A'),
+        f"{result.get('percentage', 0)}%",
+        str(result.get('date', 'N/A'))[:16]
+    ] for result in results)
+    
+    return _build_pdf_files("KITOBXON KIDS - Test Natijalari", headers, rows, [150, 40, 60, 60, 60, 100],
+                            letter, (11, 9), max_rows, first_part)
+
+def generate_users_pdf_report(users: Iterable[tuple], max_rows: int = PDF_MAX_ROWS) -> List[bytes]:
+    """Generate PDF report of registered users from (user ID, user data) pairs, split above max_rows users"""
+    headers = ['Farzand nomi', 'Ota-ona', 'Yosh', 'Viloyat', 'Tuman', 'Telegram ID', 'Username', 'Telefon', 'Ro\'yxat sanasi']
+    
+    def user_rows():
+        for user_id, user_data in users:
+            username = user_data.get('username', 'N/A')
+            if username != 'N/A' and not username.startswith('@'):
+                username = f"@{username}"
+            yield [
+                user_data.get('child_name', 'N/A'),
+                user_data.get('parent_name', 'N/A'),
+                user_data.get('age', 'N/A'),
+                user_data.get('region', 'N/A'),
+                user_data.get('district', 'N/A'),
+                user_id,
+                username,
+                user_data.get('phone', 'N/A'),
+                user_data.get('registration_date', 'N/A')[:10] if user_data.get('registration_date') else 'N/A'
+            ]
+    
+    # Landscape page for the wide table
+    col_widths = [90, 90, 35, 80, 80, 65, 80, 75, 65]
+    return _build_pdf_files("KITOBXON KIDS - Ro'yxatdan o'tgan foydalanuvchilar", headers, user_rows(), col_widths,
+                            landscape(A4), (9, 7), max_rows)
+
+def _add_excel_styles(wb) -> None:
+    """Register the named styles shared by all cells of an export, instead of styling cell by cell"""
+    thin = Side(style='thin')
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    wb.add_named_style(NamedStyle(
+        name="header", font=Font(bold=True, size=12, color='FFFFFF'), border=border,
+        alignment=Alignment(horizontal='center', vertical='center'),
+        fill=PatternFill(start_color='366092', end_color='366092', fill_type='solid')))
+    wb.add_named_style(NamedStyle(
+        name="row", font=Font(size=10), border=border,
+        alignment=Alignment(horizontal='left', vertical='center', wrap_text=True)))
+    wb.add_named_style(NamedStyle(
+        name="row_alt", font=Font(size=10), border=border,
+        alignment=Alignment(horizontal='left', vertical='center', wrap_text=True),
+        fill=PatternFill(start_color='F2F2F2', end_color='F2F2F2', fill_type='solid')))
+
+def _excel_row(ws, values: Iterable, style: str) -> List:
+    """Cells of one write-only row, all in the given named style"""
+    cells = []
+    for value in values:
+        cell = WriteOnlyCell(ws, value=value)
+        cell.style = style
+        cells.append(cell)
+    return cells
+
+def _new_excel_sheet(title: str, headers: List[str], column_widths: List[int], row_height: Optional[float] = None):
+    """Write-only workbook with one sheet and its header row; rows go straight to the file as they are added"""
+    wb = openpyxl.Workbook(write_only=True)
+    _add_excel_styles(wb)
+    ws = wb.create_sheet(title)
+    # Layout must be set before the first row is written
+    for i, width in enumerate(column_widths, 1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+    if row_height:
+        ws.sheet_format.defaultRowHeight = row_height
+        ws.sheet_format.customHeight = True
+    ws.freeze_panes = 'A2'
+    ws.append(_excel_row(ws, headers, "header"))
+    return wb, ws
+
+def _save_workbook(wb) -> bytes:
+    buffer = BytesIO()
+    wb.save(buffer)
     return buffer.getvalue()
 
-def generate_users_excel_report(users_data: Dict) -> bytes:
-    """Generate Excel report of registered users"""
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Foydalanuvchilar"
-    
-    # Headers
+def generate_users_excel_report(users: Iterable[tuple]) -> bytes:
+    """Generate Excel report of registered users from (user ID, user data) pairs"""
     headers = ['Farzand nomi', 'Ota-ona', 'Yosh', 'Viloyat', 'Tuman', 'Mahalla', 'Telegram ID', 'Username', 'Telefon', 'Ro\'yxat sanasi']
-    ws.append(headers)
-    
-    # Style headers and set column widths
     column_widths = [20, 25, 8, 18, 18, 20, 15, 18, 18, 15]
-    for i, (cell, width) in enumerate(zip(ws[1], column_widths), 1):
-        cell.font = Font(bold=True, size=12)
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        cell.font = Font(bold=True, size=12, color='FFFFFF')
-        
-        # Set column width
-        column_letter = ws.cell(row=1, column=i).column_letter
-        ws.column_dimensions[column_letter].width = width
+    wb, ws = _new_excel_sheet("Foydalanuvchilar", headers, column_widths, row_height=25)
     
-    # Add data with proper formatting
-    for user_id, user_data in users_data.items():
+    for row_num, (user_id, user_data) in enumerate(users, 2):
         username = user_data.get('username', 'N/A')
         if username != 'N/A' and not username.startswith('@'):
             username = f"@{username}"
@@ -370,63 +2199,19 @@ def generate_users_excel_report(users_data: Dict) -> bytes:
             user_data.get('phone', 'N/A'),
             user_data.get('registration_date', 'N/A')[:10] if user_data.get('registration_date') else 'N/A'
         ]
-        
-        ws.append(row_data)
-        
-        # Format the newly added row
-        row_num = ws.max_row
-        for col_num in range(1, len(headers) + 1):
-            cell = ws.cell(row=row_num, column=col_num)
-            cell.alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
-            cell.font = Font(size=10)
-            
-            # Add alternating row colors
-            if row_num % 2 == 0:
-                cell.fill = PatternFill(start_color='F2F2F2', end_color='F2F2F2', fill_type='solid')
-    
-    # Set row heights for better visibility
-    for row in ws.iter_rows(min_row=2, max_row=ws.max_row):
-        ws.row_dimensions[row[0].row].height = 25
-    
-    # Freeze the header row
-    ws.freeze_panes = 'A2'
-    
-    # Add borders to all cells
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    
-    for row in ws.iter_rows(min_row=1, max_row=ws.max_row, min_col=1, max_col=len(headers)):
-        for cell in row:
-            cell.border = thin_border
+        # Alternating row colors
+        ws.append(_excel_row(ws, row_data, "row_alt" if row_num % 2 == 0 else "row"))
     
-    # Save to bytes
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    return buffer.getvalue()
+    return _save_workbook(wb)
 
-def generate_excel_report(results: List[Dict]) -> bytes:
+def generate_excel_report(results: Iterable[Dict]) -> bytes:
     """Generate Excel report of test results"""
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Test Natijalari"
-    
-    # Headers
     headers = ['Foydalanuvchi', 'Telegram ID', 'Username', 'Yosh', 'Ball', 'Vaqt', 'Foiz', 'Sana']
-    ws.append(headers)
+    column_widths = [25, 15, 18, 8, 10, 10, 10, 20]
+    wb, ws = _new_excel_sheet("Test Natijalari", headers, column_widths)
     
-    # Style headers
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal='center')
-    
-    # Add data
     for result in results:
-        ws.append([
+        ws.append(_excel_row(ws, [
             result.get('user_name', 'N/A'),
             result.get('telegram_id', 'N/A'),
             result.get('username', 'N/A'),
@@ -435,74 +2220,239 @@ def generate_excel_report(results: List[Dict]) -> bytes:
             result.get('time_taken', 'N/A'),
             f"{result.get('percentage', 0)}%",
             result.get('date', 'N/A')
-        ])
+        ], "row"))
     
-    # Save to bytes
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    return buffer.getvalue()
+    return _save_workbook(wb)
+
+# 📌 Report jobs: rendered in the process pool, reading data straight from storage
+REPORT_GENERATORS = {
+    "results_pdf": generate_pdf_report,
+    "results_excel": generate_excel_report,
+    "users_pdf": generate_users_pdf_report,
+    "users_excel": generate_users_excel_report,
+}
+REPORT_EXTENSIONS = {"results_pdf": "pdf", "results_excel": "xlsx", "users_pdf": "pdf", "users_excel": "xlsx"}
+# Bump when the report layout changes so cached files are rendered again
+REPORT_CACHE_FORMAT = 1
 
-def extract_text_from_pdf(pdf_bytes: bytes) -> str:
-    """Extract text from PDF file"""
+# 📦 Report cache: bot_data/reports/<kind>_<part>.<ext> plus <kind>.json with the data version they show
+def _report_data_version(kind: str) -> Dict:
+    data_version = get_results_version() if kind.startswith("results") else get_users_version()
+    version = {"format": REPORT_CACHE_FORMAT, "data": data_version, "max_rows": PDF_MAX_ROWS}
+    # Compare in the form the version takes after a round trip through the meta file
+    return json.loads(json.dumps(version))
+
+def _read_report_meta(kind: str) -> Optional[Dict]:
     try:
-        pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_bytes))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        logging.error(f"Error extracting text from PDF: {e}")
-        return ""
+        with open(os.path.join(REPORTS_DIR, f"{kind}.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _read_report_parts(kind: str, count: int) -> Optional[List[bytes]]:
+    parts = []
+    for i in range(1, count + 1):
+        try:
+            with open(os.path.join(REPORTS_DIR, f"{kind}_{i}.{REPORT_EXTENSIONS[kind]}"), 'rb') as f:
+                parts.append(f.read())
+        except FileNotFoundError:
+            return None
+    return parts
+
+def _store_report(kind: str, version: Dict, parts: List[bytes], part_starts: List, first_new: int = 0) -> None:
+    """Write report files from parts[first_new] on, then the meta file that makes them valid"""
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    for i, data in enumerate(parts[first_new:], first_new + 1):
+        _write_bytes_atomic(os.path.join(REPORTS_DIR, f"{kind}_{i}.{REPORT_EXTENSIONS[kind]}"), data)
+    meta = {"version": version, "parts": [{"start": start} for start in part_starts]}
+    _write_text_atomic(os.path.join(REPORTS_DIR, f"{kind}.json"), json.dumps(meta))
+
+def _report_result(kind: str, parts: List[bytes]) -> Any:
+    # PDF reports may be split into several files; Excel reports are one file
+    return parts if REPORT_EXTENSIONS[kind] == "pdf" else parts[0]
+
+def load_cached_report(kind: str) -> Optional[Any]:
+    """Stored report if the data hasn't changed since it was rendered, else None"""
+    meta = _read_report_meta(kind)
+    if not meta or meta["version"] != _report_data_version(kind):
+        return None
+    parts = _read_report_parts(kind, len(meta["parts"]))
+    return _report_result(kind, parts) if parts else None
+
+def _render_results_pdf(version: Dict) -> List[bytes]:
+    """Results PDF; when results were only appended, files that are already full are kept
+    and only the last one is rendered again, reading the log from where that file starts"""
+    meta = _read_report_meta("results_pdf")
+    kept, kept_starts, resume_from = [], [], None
+    if meta and len(meta["parts"]) > 1 and meta["parts"][-1]["start"] is not None:
+        old, new = meta["version"], version
+        appended = (old["format"], old["max_rows"], old["data"][:2]) == (new["format"], new["max_rows"], new["data"][:2]) \
+            and new["data"][2] >= old["data"][2]
+        if appended:
+            kept = _read_report_parts("results_pdf", len(meta["parts"]) - 1) or []
+            if kept:
+                kept_starts = [part["start"] for part in meta["parts"][:-1]]
+                resume_from = meta["parts"][-1]["start"]
+    
+    starts = []
+    
+    def rows():
+        # Remember where each new file starts so the next render can resume there
+        for i, (cursor, result) in enumerate(iter_results_from(resume_from)):
+            if i == 0 or (PDF_MAX_ROWS and i % PDF_MAX_ROWS == 0):
+                starts.append(cursor)
+            yield result
+    
+    new_parts = generate_pdf_report(rows(), first_part=len(kept) + 1)
+    if not kept:
+        # The first file always starts at the beginning, legacy results included
+        starts[:1] = [None]
+    parts = kept + new_parts
+    _store_report("results_pdf", version, parts, kept_starts + starts, first_new=len(kept))
+    return parts
+
+def render_report(kind: str) -> Any:
+    """Render one report and cache it; runs in a worker process, so only the report name crosses the process boundary"""
+    # Read the version before the data: anything saved meanwhile makes the next request render again
+    version = _report_data_version(kind)
+    if kind == "results_pdf":
+        return _render_results_pdf(version)
+    
+    report = REPORT_GENERATORS[kind](get_results() if kind.startswith("results") else iter_users())
+    parts = report if isinstance(report, list) else [report]
+    _store_report(kind, version, parts, [None] * len(parts))
+    return report
+
+def render_filtered_report(kind: str, filters: Dict, refs: Optional[List]) -> tuple:
+    """(report, row count) of the rows matching the filters, not cached; runs in a worker process,
+    which reads the rows itself (refs come from filtered_refs in the bot process)"""
+    if kind.startswith("results"):
+        rows = iter_filtered_results(filters, refs)
+    else:
+        rows = iter_filtered_users(filters, refs)
+    count = 0
+    
+    def counted():
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+    
+    report = REPORT_GENERATORS[kind](counted())
+    return report, count
+
+_report_jobs: Dict[str, asyncio.Future] = {}
+
+async def _run_report_job(kind: str) -> Any:
+    # Worker processes read the files, so pending JSON saves must reach the disk first
+    await flush_all_json()
+    cached = await run_blocking(load_cached_report, kind)
+    if cached is not None:
+        return cached
+    return await run_in_process(render_report, kind)
+
+async def render_report_async(kind: str) -> Any:
+    """Render a report in the process pool; admins asking for the same report at once share one job"""
+    job = _report_jobs.get(kind)
+    if job is None:
+        job = asyncio.ensure_future(_run_report_job(kind))
+        _report_jobs[kind] = job
+        job.add_done_callback(lambda _: _report_jobs.pop(kind, None))
+    return await asyncio.shield(job)
+
+# 📦 Raw exports: gzip-compressed CSV or NDJSON written row by row from the same rows as the reports
+USER_EXPORT_FIELDS = ['user_id', 'child_name', 'parent_name', 'age', 'region', 'district', 'mahalla', 'phone',
+                      'telegram_id', 'username', 'registration_date']
+RESULT_EXPORT_FIELDS = ['user_id', 'user_name', 'telegram_id', 'username', 'age', 'age_group', 'region', 'district',
+                        'score', 'correct_answers', 'total_questions', 'percentage', 'time_taken', 'date', 'answers']
+EXPORT_FORMATS = ["csv", "ndjson"]
+
+def _export_records(source: str) -> Iterator[Dict]:
+    if source == "results":
+        return get_results()
+    return ({'user_id': user_id, **user_data} for user_id, user_data in iter_users())
+
+def write_raw_export(source: str, fmt: str, path: str) -> int:
+    """Stream users or results into a .gz file at path; runs in a worker process. Returns the row count"""
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='', compresslevel=EXPORT_GZIP_LEVEL) as f:
+        if fmt == "csv":
+            fields = RESULT_EXPORT_FIELDS if source == "results" else USER_EXPORT_FIELDS
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+            writer.writeheader()
+            for record in _export_records(source):
+                if 'answers' in record:
+                    # One cell per result: the answer list as compact JSON
+                    record = {**record, 'answers': json.dumps(record['answers'], ensure_ascii=False,
+                                                              separators=(',', ':'))}
+                writer.writerow(record)
+                count += 1
+        else:
+            for record in _export_records(source):
+                f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+                count += 1
+    return count
+
+# 📄 Question PDFs: read from a temp file in the process pool, a batch of pages per task
+def count_pdf_pages(path: str) -> int:
+    return len(PyPDF2.PdfReader(path).pages)
+
+def extract_pdf_pages(path: str, start: int, stop: int) -> List[str]:
+    """Text of pages start..stop-1; runs in a worker process"""
+    pages = PyPDF2.PdfReader(path).pages
+    return [pages[i].extract_text() or "" for i in range(start, stop)]
 
 # 📌 Main bot handlers
 
 @dp.message(Command("start"))
-async def start(message: types.Message, state: FSMContext):
+async def start(message: types.Message, state: FSMContext, role: Optional[str] = None):
     """Start command handler"""
     user_id = message.from_user.id
     
     # Check subscription
-    try:
-        chat_member = await bot.get_chat_member(chat_id=CHANNEL_USERNAME, user_id=user_id)
-        if chat_member.status not in ["member", "administrator", "creator"]:
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="✉️ Obuna bo'lish", url=f"https://t.me/{CHANNEL_USERNAME[1:]}")],
-                [InlineKeyboardButton(text="✅ Obuna bo'ldim", callback_data="check_sub")]
-            ])
+    subscribed = await subscription_cache.is_subscribed(user_id)
+    if not subscribed:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✉️ Obuna bo'lish", url=f"https://t.me/{CHANNEL_USERNAME[1:]}")],
+            [InlineKeyboardButton(text="✅ Obuna bo'ldim", callback_data="check_sub")]
+        ])
+        if subscribed is None:
+            await message.answer("⚠️ Obunani hozir tekshirib bo'lmadi. Birozdan so'ng \"✅ Obuna bo'ldim\" tugmasini "
+                                 "bosing.", reply_markup=keyboard)
+        else:
             await message.answer("✉️ Iltimos, quyidagi kanalga obuna bo'ling:", reply_markup=keyboard)
-            await state.set_state(Registration.check_subscription)
-            return
-    except Exception as e:
-        logging.error(f"Error checking subscription: {e}")
+        await state.set_state(Registration.check_subscription)
+        return
     
     # Check if user is admin
-    if is_admin(user_id):
-        is_super = is_super_admin(user_id)
-        role = "Super Admin" if is_super else "Admin"
-        await message.answer(f"👋 Salom, {role}! Admin paneliga xush kelibsiz!", 
+    if role:
+        is_super = role == "super_admin"
+        role_name = "Super Admin" if is_super else "Admin"
+        await message.answer(f"👋 Salom, {role_name}! Admin paneliga xush kelibsiz!", 
                            reply_markup=get_admin_menu(is_super))
     else:
         await message.answer("👋 Salom! 'KITOBXON KIDS' botiga xush kelibsiz!", 
                            reply_markup=get_main_menu())
 
 @dp.callback_query(F.data == "check_sub")
-async def check_subscription(callback_query: types.CallbackQuery, state: FSMContext):
+async def check_subscription(callback_query: types.CallbackQuery, state: FSMContext, role: Optional[str] = None):
     """Check subscription callback"""
     user_id = callback_query.from_user.id
     
-    try:
-        chat_member = await bot.get_chat_member(chat_id=CHANNEL_USERNAME, user_id=user_id)
-        if chat_member.status not in ["member", "administrator", "creator"]:
-            await callback_query.answer("❌ Hali ham obuna emassiz!", show_alert=True)
-            return
-    except Exception as e:
-        logging.error(f"Error checking subscription: {e}")
+    # The user says they just subscribed, so don't trust a cached "no"
+    subscribed = await subscription_cache.is_subscribed(user_id, refresh=True)
+    if subscribed is None:
+        await callback_query.answer("⚠️ Obunani hozir tekshirib bo'lmadi, birozdan so'ng qayta urinib ko'ring.",
+                                    show_alert=True)
+        return
+    if not subscribed:
+        await callback_query.answer("❌ Hali ham obuna emassiz!", show_alert=True)
+        return
     
-    if is_admin(user_id):
-        is_super = is_super_admin(user_id)
-        role = "Super Admin" if is_super else "Admin"
-        await bot.send_message(user_id, f"👋 Salom, {role}! Admin paneliga xush kelibsiz!", 
+    if role:
+        is_super = role == "super_admin"
+        role_name = "Super Admin" if is_super else "Admin"
+        await bot.send_message(user_id, f"👋 Salom, {role_name}! Admin paneliga xush kelibsiz!", 
                              reply_markup=get_admin_menu(is_super))
     else:
         await bot.send_message(user_id, "👋 Salom! 'KITOBXON KIDS' botiga xush kelibsiz!", 
@@ -603,7 +2553,7 @@ async def register_phone(message: types.Message, state: FSMContext):
     user_data['registration_date'] = datetime.now().isoformat()
 
     # Save user data
-    save_user(str(message.from_user.id), user_data)
+    await save_user_async(str(message.from_user.id), user_data)
 
     # Send registration info to all admins (both super admin and regular admins)
     reg_info = (
@@ -621,12 +2571,7 @@ async def register_phone(message: types.Message, state: FSMContext):
     )
 
     # Send to all admins including both super admin and regular admins
-    admins = get_admins()
-    for admin_id in admins.keys():
-        try:
-            await bot.send_message(int(admin_id), reg_info)
-        except Exception as e:
-            logging.error(f"Error sending message to admin {admin_id}: {e}")
+    admin_notifier.notify_event("registration", reg_info, {'region': user_data['region']})
 
     await message.answer("✅ Ro'yxatdan o'tish muvaffaqiyatli yakunlandi!", reply_markup=get_main_menu())
     await state.clear()
@@ -635,77 +2580,86 @@ async def register_phone(message: types.Message, state: FSMContext):
 @dp.message(F.text == "📝 Test topshirish")
 async def start_test(message: types.Message, state: FSMContext):
     """Start test process"""
-    user_id = str(message.from_user.id)
-    users = get_users()
+    user_data = await get_user_async(str(message.from_user.id))
     
-    if user_id not in users:
+    if not user_data:
         await message.answer("❌ Test topshirishdan oldin ro'yxatdan o'ting!")
         return
     
-    user_age = int(users[user_id]['age'])
-    age_group = "7-10" if user_age <= 10 else "11-14"
+    age_group = get_age_group(user_data['age'])
     
-    tests = get_tests()
-    available_tests = tests.get(age_group, {})
+    question_index = _get_question_index()
     
-    if not available_tests:
+    if not question_index.book_counts.get(age_group):
         await message.answer("❌ Sizning yosh guruhingiz uchun testlar mavjud emas!")
         return
     
-    # Select 25 random questions from available tests
-    all_questions = []
-    for test_id, test_data in available_tests.items():
-        questions = test_data.get('questions', [])
-        all_questions.extend([(test_id, q) for q in questions])
-    
-    if len(all_questions) < 25:
+    if question_index.count(age_group) < TEST_STAGE['questions']:
         await message.answer("❌ Yetarli miqdorda test savollari mavjud emas!")
         return
     
-    selected_questions = random.sample(all_questions, 25)
-    
-    # Initialize test session
+    # Select random questions from the age group's question index
+    test_ids = []
+    test_positions = {}
+    selected_questions = []
+    for test_id, index in question_index.draw(age_group, TEST_STAGE['questions']):
+        if test_id not in test_positions:
+            test_positions[test_id] = len(test_ids)
+            test_ids.append(test_id)
+        selected_questions.append([test_positions[test_id], index])
+    
+    # Initialize test session: [test index, question index] pairs, answer
+    # letters ('-' on timeout) and a bitmask of correct answers
     test_session = {
+        'tests': test_ids,
         'questions': selected_questions,
         'current_question': 0,
-        'answers': [],
+        'answers': "",
+        'correct': 0,
+        'seconds': TEST_STAGE['seconds'],
         'start_time': datetime.now().isoformat(),
         'age_group': age_group
     }
     
     await state.update_data(test_session=test_session)
-    await send_next_question(message, state)
+    await send_next_question_by_id(message.chat.id, state)
 
-async def send_next_question(message: types.Message, state: FSMContext):
-    """Send next test question"""
-    data = await state.get_data()
-    test_session = data['test_session']
-    
-    if test_session['current_question'] >= len(test_session['questions']):
-        await complete_test(message, state)
-        return
-    
-    question_data = test_session['questions'][test_session['current_question']][1]
-    question_num = test_session['current_question'] + 1
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=f"A) {question_data['option_a']}", callback_data="answer_a")],
-        [InlineKeyboardButton(text=f"B) {question_data['option_b']}", callback_data="answer_b")],
-        [InlineKeyboardButton(text=f"C) {question_data['option_c']}", callback_data="answer_c")],
-        [InlineKeyboardButton(text=f"D) {question_data['option_d']}", callback_data="answer_d")]
-    ])
-    
-    question_text = f"📝 Savol {question_num}/25\n\n{question_data['question']}"
-    
-    await message.answer(question_text, reply_markup=keyboard)
-    await state.set_state(TestStates.test_question)
-    
-    # Set 1-minute timer
-    asyncio.create_task(question_timer(message.from_user.id, state, question_num))
+def session_question_id(test_session: Dict, position: int) -> str:
+    """Question ID of the question at a position of a test session"""
+    test_index, question_index = test_session['questions'][position]
+    return f"{test_session['tests'][test_index]}:{question_index}"
+
+def _current_question(test_session: Dict) -> Optional[Dict]:
+    """Resolve the current question, skipping questions whose test was deleted"""
+    while test_session['current_question'] < len(test_session['questions']):
+        question_data = get_question(session_question_id(test_session, test_session['current_question']))
+        if question_data is not None:
+            return question_data
+        test_session['answers'] += '-'
+        test_session['current_question'] += 1
+    return None
+
+def unpack_answers(test_session: Dict) -> List[Dict]:
+    """Expand the packed answer vector of a test session"""
+    return [
+        {'question_id': session_question_id(test_session, i), 'answer': None if answer == '-' else answer,
+         'correct': bool(test_session['correct'] >> i & 1)}
+        for i, answer in enumerate(test_session['answers'])
+    ]
+
+def restore_question_deadlines() -> int:
+    """Give tests restored from fsm.db a fresh timer for their current question; deadlines aren't persisted"""
+    restored = 0
+    for user_id, data in dp.storage.sessions_in_state(bot.id, TestStates.test_question):
+        test_session = data.get('test_session')
+        if test_session and test_session['current_question'] < len(test_session['questions']):
+            question_deadlines.schedule(user_id, test_session['seconds'], test_session['current_question'] + 1)
+            restored += 1
+    return restored
 
-async def question_timer(user_id: int, state: FSMContext, question_num: int):
-    """1-minute timer for each question"""
-    await asyncio.sleep(60)  # 1 minute
+async def on_question_timeout(user_id: int, question_num: int):
+    """Move on to the next question when the time for a question is up"""
+    state = dp.fsm.get_context(bot, chat_id=user_id, user_id=user_id)
     
     try:
         current_state = await state.get_state()
@@ -715,7 +2669,7 @@ async def question_timer(user_id: int, state: FSMContext, question_num: int):
             
             if test_session.get('current_question', 0) + 1 == question_num:
                 # Time's up for this question
-                test_session['answers'].append({'answer': None, 'correct': False})
+                test_session['answers'] += '-'
                 test_session['current_question'] += 1
                 await state.update_data(test_session=test_session)
                 
@@ -730,24 +2684,26 @@ async def question_timer(user_id: int, state: FSMContext, question_num: int):
         logging.error(f"Error in question timer: {e}")
 
 async def send_next_question_by_id(user_id: int, state: FSMContext):
-    """Send next question by user ID"""
+    """Send the next test question, or the results after the last one"""
     data = await state.get_data()
     test_session = data['test_session']
+    question_data = _current_question(test_session)
+    await state.update_data(test_session=test_session)
     
-    question_data = test_session['questions'][test_session['current_question']][1]
-    question_num = test_session['current_question'] + 1
+    if question_data is None:
+        await complete_test_by_id(user_id, state)
+        return
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=f"A) {question_data['option_a']}", callback_data="answer_a")],
-        [InlineKeyboardButton(text=f"B) {question_data['option_b']}", callback_data="answer_b")],
-        [InlineKeyboardButton(text=f"C) {question_data['option_c']}", callback_data="answer_c")],
-        [InlineKeyboardButton(text=f"D) {question_data['option_d']}", callback_data="answer_d")]
-    ])
+    question_num = test_session['current_question'] + 1
+    question_text, keyboard = question_payloads.get(
+        session_question_id(test_session, test_session['current_question']), question_data)
     
-    question_text = f"📝 Savol {question_num}/25\n\n{question_data['question']}"
+    await bot.send_message(user_id, f"📝 Savol {question_num}/{len(test_session['questions'])}\n\n{question_text}",
+                           reply_markup=keyboard)
+    await state.set_state(TestStates.test_question)
     
-    await bot.send_message(user_id, question_text, reply_markup=keyboard)
-    asyncio.create_task(question_timer(user_id, state, question_num))
+    # Start the question timer
+    question_deadlines.schedule(user_id, test_session['seconds'], question_num)
 
 async def complete_test_by_id(user_id: int, state: FSMContext):
     """Complete test by user ID"""
@@ -755,17 +2711,17 @@ async def complete_test_by_id(user_id: int, state: FSMContext):
     test_session = data['test_session']
     
     # Calculate results
-    correct_answers = sum(1 for answer in test_session['answers'] if answer.get('correct', False))
-    score = correct_answers * 4
-    percentage = (correct_answers / 25) * 100
+    total_questions = len(test_session['questions'])
+    correct_answers = bin(test_session['correct']).count('1')
+    score = round(correct_answers * 100 / total_questions)
+    percentage = (correct_answers / total_questions) * 100
     
     start_time = datetime.fromisoformat(test_session['start_time'])
     end_time = datetime.now()
     time_taken = str(end_time - start_time).split('.')[0]
     
     # Get user data
-    users = get_users()
-    user_data = users.get(str(user_id), {})
+    user_data = await get_user_async(str(user_id)) or {}
     
     # Save result
     result_data = {
@@ -775,22 +2731,24 @@ async def complete_test_by_id(user_id: int, state: FSMContext):
         'username': user_data.get('username', 'N/A'),
         'age': user_data.get('age', 'N/A'),
         'age_group': test_session['age_group'],
+        'region': user_data.get('region'),
+        'district': user_data.get('district'),
         'score': score,
         'correct_answers': correct_answers,
-        'total_questions': 25,
+        'total_questions': total_questions,
         'percentage': round(percentage, 2),
         'time_taken': time_taken,
         'date': datetime.now().isoformat(),
-        'answers': test_session['answers']
+        'answers': unpack_answers(test_session)
     }
     
-    save_result(result_data)
+    await save_result_async(result_data)
     
     # Send result to user
     result_text = (
         f"✅ Test yakunlandi!\n\n"
         f"📊 Natijalar:\n"
-        f"✅ To'g'ri javoblar: {correct_answers}/25\n"
+        f"✅ To'g'ri javoblar: {correct_answers}/{total_questions}\n"
         f"⭐ Ball: {score}/100\n"
         f"📈 Foiz: {percentage:.1f}%\n"
         f"⏱ Vaqt: {time_taken}"
@@ -805,18 +2763,15 @@ async def complete_test_by_id(user_id: int, state: FSMContext):
         f"🆔 Telegram ID: {user_id}\n"
         f"👤 Username: @{user_data.get('username', 'N/A')}\n"
         f"📅 Yosh: {user_data.get('age', 'N/A')}\n"
-        f"✅ To'g'ri javoblar: {correct_answers}/25\n"
+        f"✅ To'g'ri javoblar: {correct_answers}/{total_questions}\n"
         f"⭐ Ball: {score}/100\n"
         f"📈 Foiz: {percentage:.1f}%\n"
         f"⏱ Vaqt: {time_taken}"
     )
     
-    admins = get_admins()
-    for admin_id in admins.keys():
-        try:
-            await bot.send_message(int(admin_id), admin_text)
-        except Exception as e:
-            logging.error(f"Error sending result to admin {admin_id}: {e}")
+    admin_notifier.notify_event("result", admin_text, {
+        'name': result_data['user_name'], 'score': score, 'time_taken': time_taken
+    })
     
     await state.clear()
 
@@ -830,97 +2785,29 @@ async def handle_test_answer(callback_query: types.CallbackQuery, state: FSMCont
         await callback_query.answer("❌ Test sessiyasi topilmadi!")
         return
     
+    question_deadlines.cancel(callback_query.from_user.id)
     selected_answer = callback_query.data.split('_')[1]  # a, b, c, or d
-    question_data = test_session['questions'][test_session['current_question']][1]
-    correct_answer = question_data['correct_answer'].lower()
+    question_data = get_question(session_question_id(test_session, test_session['current_question'])) or {}
+    correct_answer = question_data.get('correct_answer', '').lower()
     
     is_correct = selected_answer == correct_answer
-    test_session['answers'].append({'answer': selected_answer, 'correct': is_correct})
-    test_session['current_question'] += 1
-    
-    await state.update_data(test_session=test_session)
-    
-    if is_correct:
-        await callback_query.answer("✅ To'g'ri javob!")
-    else:
-        await callback_query.answer(f"❌ Noto'g'ri. To'g'ri javob: {correct_answer.upper()}")
-    
-    # Send next question or complete test
-    if test_session['current_question'] >= len(test_session['questions']):
-        await complete_test(callback_query.message, state)
-    else:
-        await send_next_question(callback_query.message, state)
-
-async def complete_test(message: types.Message, state: FSMContext):
-    """Complete test and show results"""
-    data = await state.get_data()
-    test_session = data['test_session']
-    
-    # Calculate results
-    correct_answers = sum(1 for answer in test_session['answers'] if answer.get('correct', False))
-    score = correct_answers * 4
-    percentage = (correct_answers / 25) * 100
-    
-    start_time = datetime.fromisoformat(test_session['start_time'])
-    end_time = datetime.now()
-    time_taken = str(end_time - start_time).split('.')[0]
-    
-    # Get user data
-    users = get_users()
-    user_data = users.get(str(message.from_user.id), {})
-    
-    # Save result
-    result_data = {
-        'user_id': message.from_user.id,
-        'user_name': user_data.get('child_name', 'N/A'),
-        'telegram_id': message.from_user.id,
-        'username': user_data.get('username', 'N/A'),
-        'age': user_data.get('age', 'N/A'),
-        'age_group': test_session['age_group'],
-        'score': score,
-        'correct_answers': correct_answers,
-        'total_questions': 25,
-        'percentage': round(percentage, 2),
-        'time_taken': time_taken,
-        'date': datetime.now().isoformat(),
-        'answers': test_session['answers']
-    }
-    
-    save_result(result_data)
-    
-    # Send result to user
-    result_text = (
-        f"✅ Test yakunlandi!\n\n"
-        f"📊 Natijalar:\n"
-        f"✅ To'g'ri javoblar: {correct_answers}/25\n"
-        f"⭐ Ball: {score}/100\n"
-        f"📈 Foiz: {percentage:.1f}%\n"
-        f"⏱ Vaqt: {time_taken}"
-    )
-    
-    await message.answer(result_text, reply_markup=get_main_menu())
+    test_session['answers'] += selected_answer
+    if is_correct:
+        test_session['correct'] |= 1 << test_session['current_question']
+    test_session['current_question'] += 1
     
-    # Send result to admins
-    admin_text = (
-        f"📊 Yangi test natijasi:\n\n"
-        f"👤 Foydalanuvchi: {user_data.get('child_name', 'N/A')}\n"
-        f"🆔 Telegram ID: {message.from_user.id}\n"
-        f"👤 Username: @{user_data.get('username', 'N/A')}\n"
-        f"📅 Yosh: {user_data.get('age', 'N/A')}\n"
-        f"✅ To'g'ri javoblar: {correct_answers}/25\n"
-        f"⭐ Ball: {score}/100\n"
-        f"📈 Foiz: {percentage:.1f}%\n"
-        f"⏱ Vaqt: {time_taken}"
-    )
+    await state.update_data(test_session=test_session)
     
-    admins = get_admins()
-    for admin_id in admins.keys():
-        try:
-            await bot.send_message(int(admin_id), admin_text)
-        except Exception as e:
-            logging.error(f"Error sending result to admin {admin_id}: {e}")
+    if is_correct:
+        await callback_query.answer("✅ To'g'ri javob!")
+    else:
+        await callback_query.answer(f"❌ Noto'g'ri. To'g'ri javob: {correct_answer.upper()}")
     
-    await state.clear()
+    # Send next question or complete test
+    if test_session['current_question'] >= len(test_session['questions']):
+        await complete_test_by_id(callback_query.from_user.id, state)
+    else:
+        await send_next_question_by_id(callback_query.from_user.id, state)
 
 # 💬 Feedback handler
 @dp.message(F.text == "💬 Fikr va maslahatlar")
@@ -947,12 +2834,7 @@ async def save_feedback(message: types.Message, state: FSMContext):
     )
     
     # Send to all admins (both super admin and regular admins)
-    admins = get_admins()
-    for admin_id in admins.keys():
-        try:
-            await bot.send_message(int(admin_id), feedback_text)
-        except Exception as e:
-            logging.error(f"Error sending feedback to admin {admin_id}: {e}")
+    admin_notifier.notify_event("feedback", feedback_text, {'name': full_name, 'text': message.text})
     
     await message.answer("✅ Fikringiz uchun rahmat!", reply_markup=get_main_menu())
     await state.clear()
@@ -1001,93 +2883,157 @@ Batafsil: @Kitobxon_Kids kanali orqali kuzatib boring.
 
 # 👨‍💼 Admin handlers
 @dp.message(F.text == "🔙 Asosiy menyu")
-async def back_to_main(message: types.Message, state: FSMContext):
+async def back_to_main(message: types.Message, state: FSMContext, role: Optional[str] = None):
     """Back to main menu"""
     await state.clear()
-    if is_admin(message.from_user.id):
-        is_super = is_super_admin(message.from_user.id)
+    if role:
+        is_super = role == "super_admin"
         await message.answer("Admin panel", reply_markup=get_admin_menu(is_super))
     else:
         await message.answer("Asosiy menyu", reply_markup=get_main_menu())
 
 @dp.message(F.text == "🔙 Orqaga")
-async def back_button(message: types.Message, state: FSMContext):
+async def back_button(message: types.Message, state: FSMContext, role: Optional[str] = None):
     """Back button handler"""
     await state.clear()
-    if is_admin(message.from_user.id):
-        is_super = is_super_admin(message.from_user.id)
+    if role:
+        is_super = role == "super_admin"
         await message.answer("Admin panel", reply_markup=get_admin_menu(is_super))
     else:
         await message.answer("Asosiy menyu", reply_markup=get_main_menu())
 
-@dp.message(F.text == "👥 Foydalanuvchilar ro'yxati")
-async def show_users(message: types.Message):
-    """Show users list (admin only)"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
-        return
-    
-    users = get_users()
-    
-    if not users:
-        await message.answer("📝 Hozircha ro'yxatdan o'tgan foydalanuvchilar yo'q.")
-        return
-    
-    users_text = "👥 Ro'yxatdan o'tgan foydalanuvchilar:\n\n"
-    
-    for i, (user_id, user_data) in enumerate(users.items(), 1):
+# 👥 User browser: one message, edited in place; callback data is "users:<page>:<region #>:<age group>"
+REGION_NAMES = list(REGIONS)
+
+def _users_callback(page: int, region: Optional[str], age_group: Optional[str]) -> str:
+    region_part = REGION_NAMES.index(region) if region else "-"
+    return f"users:{page}:{region_part}:{age_group or '-'}"
+
+async def render_users_page(page: int, region: Optional[str], age_group: Optional[str]) -> tuple:
+    """Text and keyboard of one user browser page; reads only the users shown on it"""
+    user_index = _get_user_index()
+    total = user_index.count(region, age_group=age_group)
+    pages = max(1, -(-total // USERS_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    user_ids = user_index.page(page * USERS_PAGE_SIZE, USERS_PAGE_SIZE, region, age_group=age_group)
+    users = await run_blocking(get_users_by_id, user_ids)
+    
+    users_text = (
+        f"👥 Ro'yxatdan o'tgan foydalanuvchilar: {total}\n"
+        f"🌍 {html.escape(region or 'Barcha viloyatlar')} | 📅 {age_group or 'Barcha yoshlar'}\n\n"
+    )
+    if not user_ids:
+        users_text += "📝 Foydalanuvchilar topilmadi."
+    for i, user_id in enumerate(user_ids, page * USERS_PAGE_SIZE + 1):
+        user_data = users.get(user_id) or {}
         username = user_data.get('username', 'Username yoq')
         if username != 'Username yoq' and not username.startswith('@'):
             username = f"@{username}"
-        
         users_text += (
-            f"{i}. {user_data.get('child_name', 'N/A')}\n"
-            f"   👤 Username: {username}\n"
+            f"{i}. {html.escape(str(user_data.get('child_name', 'N/A')))}\n"
+            f"   👤 Username: {html.escape(username)}\n"
             f"   🆔 Telegram ID: {user_id}\n"
             f"   📅 Yosh: {user_data.get('age', 'N/A')}\n"
-            f"   🌍 Viloyat: {user_data.get('region', 'N/A')}\n"
-            f"   🏙 Tuman: {user_data.get('district', 'N/A')}\n"
+            f"   🌍 Viloyat: {html.escape(str(user_data.get('region', 'N/A')))}\n"
+            f"   🏙 Tuman: {html.escape(str(user_data.get('district', 'N/A')))}\n"
             f"   📞 Telefon: {user_data.get('phone', 'N/A')}\n"
-            f"   📅 Ro'yxat sanasi: {user_data.get('registration_date', 'N/A')}\n\n"
+            f"   📅 Ro'yxat sanasi: {user_data.get('registration_date', 'N/A')[:16]}\n\n"
         )
-        
-        # Split long messages
-        if len(users_text) > 3500:
-            await message.answer(users_text)
-            users_text = ""
     
-    if users_text:
-        await message.answer(users_text)
+    def button(text: str, target: int) -> InlineKeyboardButton:
+        # Buttons that would not change the page do nothing
+        target = min(max(target, 0), pages - 1)
+        data = _users_callback(target, region, age_group) if target != page else "users:noop"
+        return InlineKeyboardButton(text=text, callback_data=data)
+    
+    next_age_group = {None: "7-10", "7-10": "11-14", "11-14": None}[age_group]
+    keyboard = [[button("◀️", page - 1), InlineKeyboardButton(text=f"📄 {page + 1}/{pages}", callback_data="users:noop"),
+                 button("▶️", page + 1)]]
+    if pages > 2:
+        keyboard.append([button("⏮", 0), button("-10", page - 10), button("+10", page + 10), button("⏭", pages - 1)])
+    keyboard.append([
+        InlineKeyboardButton(text="🌍 Viloyat", callback_data=f"users_regions:{'-' if age_group is None else age_group}"),
+        InlineKeyboardButton(text=f"📅 {next_age_group or 'Barcha yoshlar'}",
+                             callback_data=_users_callback(0, region, next_age_group)),
+    ])
+    return users_text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+@dp.message(F.text == "👥 Foydalanuvchilar ro'yxati")
+async def show_users(message: types.Message, role: Optional[str] = None):
+    """Show users list page by page (admin only)"""
+    if not role:
+        await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
+        return
+    
+    if not _get_user_index().count():
+        await message.answer("📝 Hozircha ro'yxatdan o'tgan foydalanuvchilar yo'q.")
+        return
+    
+    users_text, keyboard = await render_users_page(0, None, None)
+    await message.answer(users_text, reply_markup=keyboard)
+
+@dp.callback_query(F.data.startswith("users"))
+async def browse_users(callback_query: types.CallbackQuery, role: Optional[str] = None):
+    """Page, filter and region picker callbacks of the user browser"""
+    if not role:
+        await callback_query.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!", show_alert=True)
+        return
+    
+    action, _, args = callback_query.data.partition(":")
+    if args == "noop":
+        await callback_query.answer()
+        return
+    
+    if action == "users_regions":
+        # Region picker keeps the age filter and starts from the first page
+        try:
+            age_group = parse_age_part(args)
+        except ValueError:
+            await callback_query.answer("⚠️ Eskirgan tugma, ro'yxatni qaytadan oching.", show_alert=True)
+            return
+        keyboard = [[InlineKeyboardButton(text="🌍 Barcha viloyatlar", callback_data=_users_callback(0, None, age_group))]]
+        buttons = [InlineKeyboardButton(text=region, callback_data=_users_callback(0, region, age_group))
+                   for region in REGION_NAMES]
+        keyboard += [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+        await callback_query.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+        await callback_query.answer()
+        return
+    
+    try:
+        page, region_part, age_part = args.split(":")
+        page = int(page)
+        region = None if region_part == "-" else REGION_NAMES[int(region_part)]
+        age_group = parse_age_part(age_part)
+    except (ValueError, IndexError):
+        await callback_query.answer("⚠️ Eskirgan tugma, ro'yxatni qaytadan oching.", show_alert=True)
+        return
+    
+    users_text, keyboard = await render_users_page(page, region, age_group)
+    await callback_query.message.edit_text(users_text, reply_markup=keyboard)
+    await callback_query.answer()
 
 @dp.message(F.text == "👨‍💼 Adminlar ro'yxati")
-async def show_admins(message: types.Message):
+async def show_admins(message: types.Message, role: Optional[str] = None):
     """Show admins list with full names and usernames (super admin only)"""
-    if not is_super_admin(message.from_user.id):
+    if role != "super_admin":
         await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
         return
     
-    admins = get_admins()
+    admins = await get_admins_async()
     
     if not admins:
         await message.answer("📝 Adminlar ro'yxati bo'sh.")
         return
     
     admins_text = "👨‍💼 Adminlar ro'yxati:\n\n"
+    await admin_profiles.load(admins)
     
     for i, (admin_id, admin_data) in enumerate(admins.items(), 1):
-        role = "🔴 Super Admin" if admin_data.get('role') == 'super_admin' else "🟡 Admin"
+        role_label = "🔴 Super Admin" if admin_data.get('role') == 'super_admin' else "🟡 Admin"
         added_date = admin_data.get('added_date', 'Noma\'lum')[:10] if admin_data.get('added_date') else 'Noma\'lum'
+        full_name, username = admin_profiles.display(admin_id)
         
-        # Try to get full name and username from Telegram
-        try:
-            admin_info = await bot.get_chat(int(admin_id))
-            full_name = admin_info.full_name or 'Ism korsatilmagan'
-            username = f"@{admin_info.username}" if admin_info.username else 'Username yoq'
-        except Exception:
-            full_name = 'Ism korsatilmagan'
-            username = 'Username yoq'
-        
-        admins_text += f"{i}. {role}\n"
+        admins_text += f"{i}. {role_label}\n"
         admins_text += f"   👤 Ism: {full_name}\n"
         admins_text += f"   👤 Username: {username}\n"
         admins_text += f"   🆔 ID: {admin_id}\n"
@@ -1101,9 +3047,9 @@ async def show_admins(message: types.Message):
         await message.answer(admins_text)
 
 @dp.message(F.text == "➕ Admin qo'shish")
-async def add_admin_prompt(message: types.Message, state: FSMContext):
+async def add_admin_prompt(message: types.Message, state: FSMContext, role: Optional[str] = None):
     """Prompt to add admin (super admin only)"""
-    if not is_super_admin(message.from_user.id):
+    if role != "super_admin":
         await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
         return
     
@@ -1148,17 +3094,18 @@ async def add_admin(message: types.Message, state: FSMContext):
             'telegram_id': admin_id
         }
         
-        save_admin(str(admin_id), admin_data)
+        await save_admin_async(str(admin_id), admin_data)
         
         await message.answer(f"✅ Admin muvaffaqiyatli qo'shildi!\n🆔 Telegram ID: {admin_id}")
         
-        # Notify new admin
+        # Notify new admin; the sent message carries their name, so cache it
         try:
-            await bot.send_message(admin_id, 
+            sent = await bot.send_message(admin_id, 
                 "🎉 Tabriklaymiz!\n\n"
                 "Siz KITOBXON KIDS botida admin lavozimiga tayinlandingiz!\n"
                 "Endi siz testlar qo'sha olasiz va foydalanuvchilar ro'yxatini ko'ra olasiz."
             )
+            admin_profiles.remember(admin_id, sent.chat.full_name, sent.chat.username)
         except Exception as e:
             logging.error(f"Error notifying new admin {admin_id}: {e}")
             await message.answer(f"⚠️ Admin qo'shildi, lekin xabar yuborishda xatolik: {e}")
@@ -1166,13 +3113,13 @@ async def add_admin(message: types.Message, state: FSMContext):
     await state.clear()
 
 @dp.message(F.text == "➖ Admin o'chirish")
-async def remove_admin_prompt(message: types.Message, state: FSMContext):
+async def remove_admin_prompt(message: types.Message, state: FSMContext, role: Optional[str] = None):
     """Prompt to remove admin (super admin only)"""
-    if not is_super_admin(message.from_user.id):
+    if role != "super_admin":
         await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
         return
     
-    admins = get_admins()
+    admins = await get_admins_async()
     regular_admins = {k: v for k, v in admins.items() if v.get('role') != 'super_admin'}
     
     if not regular_admins:
@@ -1181,15 +3128,10 @@ async def remove_admin_prompt(message: types.Message, state: FSMContext):
     
     admin_list = "➖ Admin o'chirish:\n\n"
     admin_list += "O'chirish uchun admin ID kiriting:\n\n"
+    await admin_profiles.load(regular_admins)
     
     for admin_id, admin_data in regular_admins.items():
-        try:
-            admin_info = await bot.get_chat(int(admin_id))
-            full_name = admin_info.full_name or 'Ism korsatilmagan'
-            username = f"@{admin_info.username}" if admin_info.username else 'Username yoq'
-        except Exception:
-            full_name = 'Ism korsatilmagan'
-            username = 'Username yoq'
+        full_name, username = admin_profiles.display(admin_id)
         
         admin_list += f"🟡 Admin\n"
         admin_list += f"   👤 Ism: {full_name}\n"
@@ -1207,7 +3149,7 @@ async def remove_admin_handler(message: types.Message, state: FSMContext):
         admin_id_to_remove = message.text.strip()
         
         # Check if the ID exists and is not a super admin
-        admins = get_admins()
+        admins = await get_admins_async()
         if admin_id_to_remove not in admins:
             await message.answer("❌ Bunday ID li admin topilmadi!")
             return
@@ -1217,16 +3159,12 @@ async def remove_admin_handler(message: types.Message, state: FSMContext):
             return
         
         # Get admin info before removing
-        try:
-            admin_info = await bot.get_chat(int(admin_id_to_remove))
-            full_name = admin_info.full_name or 'Ism korsatilmagan'
-            username = f"@{admin_info.username}" if admin_info.username else 'Username yoq'
-        except Exception:
-            full_name = 'Ism korsatilmagan'
-            username = 'Username yoq'
+        await admin_profiles.load([admin_id_to_remove])
+        full_name, username = admin_profiles.display(admin_id_to_remove)
         
         # Remove admin
-        if remove_admin(admin_id_to_remove):
+        if await remove_admin_async(admin_id_to_remove):
+            admin_profiles.forget(admin_id_to_remove)
             await message.answer(
                 f"✅ Admin muvaffaqiyatli o'chirildi!\n\n"
                 f"👤 Ism: {full_name}\n"
@@ -1254,13 +3192,13 @@ async def remove_admin_handler(message: types.Message, state: FSMContext):
     await state.clear()
 
 @dp.message(F.text == "⬆️ Super Admin tayinlash")
-async def promote_super_admin_prompt(message: types.Message, state: FSMContext):
+async def promote_super_admin_prompt(message: types.Message, state: FSMContext, role: Optional[str] = None):
     """Prompt to promote admin to super admin (super admin only)"""
-    if not is_super_admin(message.from_user.id):
+    if role != "super_admin":
         await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
         return
     
-    admins = get_admins()
+    admins = await get_admins_async()
     regular_admins = {k: v for k, v in admins.items() if v.get('role') != 'super_admin'}
     
     if not regular_admins:
@@ -1269,15 +3207,10 @@ async def promote_super_admin_prompt(message: types.Message, state: FSMContext):
     
     admin_list = "⬆️ Super Admin tayinlash:\n\n"
     admin_list += "Super Admin qilish uchun admin ID kiriting:\n\n"
+    await admin_profiles.load(regular_admins)
     
     for admin_id, admin_data in regular_admins.items():
-        try:
-            admin_info = await bot.get_chat(int(admin_id))
-            full_name = admin_info.full_name or 'Ism korsatilmagan'
-            username = f"@{admin_info.username}" if admin_info.username else 'Username yoq'
-        except Exception:
-            full_name = 'Ism korsatilmagan'
-            username = 'Username yoq'
+        full_name, username = admin_profiles.display(admin_id)
         
         admin_list += f"🟡 Admin\n"
         admin_list += f"   👤 Ism: {full_name}\n"
@@ -1295,7 +3228,7 @@ async def promote_super_admin_handler(message: types.Message, state: FSMContext)
         admin_id_to_promote = message.text.strip()
         
         # Check if the ID exists and is a regular admin
-        admins = get_admins()
+        admins = await get_admins_async()
         if admin_id_to_promote not in admins:
             await message.answer("❌ Bunday ID li admin topilmadi!")
             return
@@ -1305,13 +3238,8 @@ async def promote_super_admin_handler(message: types.Message, state: FSMContext)
             return
         
         # Get admin info before promoting
-        try:
-            admin_info = await bot.get_chat(int(admin_id_to_promote))
-            full_name = admin_info.full_name or 'Ism korsatilmagan'
-            username = f"@{admin_info.username}" if admin_info.username else 'Username yoq'
-        except Exception:
-            full_name = 'Ism korsatilmagan'
-            username = 'Username yoq'
+        await admin_profiles.load([admin_id_to_promote])
+        full_name, username = admin_profiles.display(admin_id_to_promote)
         
         # Update admin role to super_admin
         admin_data = admins[admin_id_to_promote].copy()
@@ -1319,7 +3247,7 @@ async def promote_super_admin_handler(message: types.Message, state: FSMContext)
         admin_data['promoted_by'] = str(message.from_user.id)
         admin_data['promoted_date'] = datetime.now().isoformat()
         
-        save_admin(admin_id_to_promote, admin_data)
+        await save_admin_async(admin_id_to_promote, admin_data)
         
         await message.answer(
             f"✅ Super Admin muvaffaqiyatli tayinlandi!\n\n"
@@ -1331,7 +3259,7 @@ async def promote_super_admin_handler(message: types.Message, state: FSMContext)
         
         # Notify the promoted admin
         try:
-            await bot.send_message(
+            sent = await bot.send_message(
                 int(admin_id_to_promote), 
                 "🎉 Tabriklaymiz!\n\n"
                 "Siz KITOBXON KIDS botida Super Admin lavozimiga tayinlandingiz!\n\n"
@@ -1343,6 +3271,7 @@ async def promote_super_admin_handler(message: types.Message, state: FSMContext)
                 "• Barcha ma'lumotlarni ko'rish\n\n"
                 "Mas'uliyat bilan foydalaning!"
             )
+            admin_profiles.remember(admin_id_to_promote, sent.chat.full_name, sent.chat.username)
         except Exception as e:
             logging.error(f"Error notifying promoted super admin: {e}")
             
@@ -1353,9 +3282,9 @@ async def promote_super_admin_handler(message: types.Message, state: FSMContext)
     await state.clear()
 
 @dp.message(F.text == "➕ Test qo'shish")
-async def add_test_age_prompt(message: types.Message, state: FSMContext):
+async def add_test_age_prompt(message: types.Message, state: FSMContext, role: Optional[str] = None):
     """Prompt to select age group for new test"""
-    if not is_admin(message.from_user.id):
+    if not role:
         await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
         return
     
@@ -1363,10 +3292,10 @@ async def add_test_age_prompt(message: types.Message, state: FSMContext):
     await state.set_state(AdminStates.add_test_age)
 
 @dp.message(AdminStates.add_test_age)
-async def add_test_age(message: types.Message, state: FSMContext):
+async def add_test_age(message: types.Message, state: FSMContext, role: Optional[str] = None):
     """Set age group for test"""
     if message.text == "🔙 Orqaga":
-        await back_button(message, state)
+        await back_button(message, state, role)
         return
     
     if message.text not in ["7-10 yosh", "11-14 yosh"]:
@@ -1393,10 +3322,10 @@ async def add_test_book(message: types.Message, state: FSMContext):
     await state.set_state(AdminStates.add_test_content)
 
 @dp.message(AdminStates.add_test_content)
-async def add_test_content_type(message: types.Message, state: FSMContext):
+async def add_test_content_type(message: types.Message, state: FSMContext, role: Optional[str] = None):
     """Handle test content type selection"""
     if message.text == "🔙 Orqaga":
-        await back_button(message, state)
+        await back_button(message, state, role)
         return
     
     if message.text == "📝 Matn ko'rinishida":
@@ -1409,6 +3338,7 @@ async def add_test_content_type(message: types.Message, state: FSMContext):
             "C) Variant 3\n"
             "D) Variant 4\n"
             "Javob: A\n\n"
+            "Variantlar A) yoki a. ko'rinishida, javob \"Javob:\" yoki \"Ответ:\" bilan yozilishi mumkin.\n"
             "Har bir test yangi qatordan boshlansin. Barcha testlarni bir xabarada yuboring."
         )
         await state.set_state(AdminStates.add_test_questions)
@@ -1421,36 +3351,38 @@ async def add_test_content_type(message: types.Message, state: FSMContext):
         await message.answer("❌ Iltimos, formatni tanlang!")
 
 @dp.message(AdminStates.add_test_questions)
-async def add_test_questions(message: types.Message, state: FSMContext):
+async def add_test_questions(message: types.Message, state: FSMContext, role: Optional[str] = None):
     """Process test questions"""
     data = await state.get_data()
     content_type = data.get('content_type')
     
-    questions = []
-    
     if content_type == "text" and message.text:
         # Parse text format questions
-        questions = parse_text_questions(message.text)
+        questions, diagnostics = await run_blocking(parse_text_questions, message.text)
     
     elif content_type == "pdf" and message.document:
         # Handle PDF file
-        if message.document.mime_type == "application/pdf":
-            try:
-                file = await bot.download(message.document)
-                text_content = extract_text_from_pdf(file.read())
-                questions = parse_text_questions(text_content)
-            except Exception as e:
-                await message.answer(f"❌ PDF ni o'qishda xatolik: {e}")
-                return
-        else:
+        if message.document.mime_type != "application/pdf":
             await message.answer("❌ Iltimos, PDF fayl yuboring!")
             return
+        if (message.document.file_size or 0) > PDF_UPLOAD_MAX_MB * 1024 * 1024:
+            await message.answer(f"❌ PDF fayl {PDF_UPLOAD_MAX_MB:g} MB dan katta bo'lmasligi kerak!")
+            return
+        try:
+            parsed = await read_pdf_questions(message)
+        except Exception as e:
+            await message.answer(f"❌ PDF ni o'qishda xatolik: {e}")
+            return
+        if parsed is None:
+            return
+        questions, diagnostics = parsed
     else:
         await message.answer("❌ Noto'g'ri format!")
         return
     
     if not questions:
-        await message.answer("❌ Testlar topilmadi yoki noto'g'ri format!")
+        await message.answer("❌ Testlar topilmadi yoki noto'g'ri format!"
+                             + (format_diagnostics(diagnostics) if diagnostics else ""))
         return
     
     # Save test
@@ -1463,77 +3395,197 @@ async def add_test_questions(message: types.Message, state: FSMContext):
         'content_type': content_type
     }
     
-    save_test(test_data)
+    await save_test_async(test_data)
     
-    is_super = is_super_admin(message.from_user.id)
+    is_super = role == "super_admin"
     await message.answer(
         f"✅ Test muvaffaqiyatli qo'shildi!\n"
         f"📚 Kitob: {data['book_name']}\n"
         f"📅 Yosh guruhi: {data['age_group']}\n"
-        f"📝 Savollar soni: {len(questions)}",
+        f"📝 Savollar soni: {len(questions)}" + (format_diagnostics(diagnostics) if diagnostics else ""),
         reply_markup=get_admin_menu(is_super)
     )
     
     await state.clear()
 
-def parse_text_questions(text: str) -> List[Dict]:
-    """Parse questions from text format"""
-    questions = []
-    
-    # Split by double newlines to separate questions
-    question_blocks = text.strip().split('\n\n')
-    
-    for block in question_blocks:
-        lines = [line.strip() for line in block.split('\n') if line.strip()]
-        
-        if len(lines) < 6:  # Need at least question + 4 options + answer
-            continue
-        
-        question_text = lines[0].rstrip('?') + '?'
-        
-        options = {}
-        correct_answer = None
+async def read_pdf_questions(message: types.Message) -> Optional[tuple]:
+    """Download an uploaded PDF to a temp file, read its pages in the process pool and stream them through the
+    question parser in page order, keeping an admin progress message up to date.
+    Returns (questions, diagnostics), or None if the PDF has too many pages"""
+    fd, path = tempfile.mkstemp(suffix=".pdf", dir=DATA_DIR)
+    os.close(fd)
+    tasks, progress, final_text = [], None, "❌ PDF o'qib bo'lmadi."
+    try:
+        await bot.download(message.document, destination=path)
+        page_count = await run_in_process(count_pdf_pages, path)
+        if page_count > PDF_UPLOAD_MAX_PAGES:
+            await message.answer(f"❌ PDF {PDF_UPLOAD_MAX_PAGES} sahifadan ko'p bo'lmasligi kerak! ({page_count} sahifa)")
+            return None
         
-        for line in lines[1:]:
-            if line.startswith('A)') or line.startswith('А)'):
-                options['option_a'] = line[2:].strip()
-            elif line.startswith('B)') or line.startswith('Б)'):
-                options['option_b'] = line[2:].strip()
-            elif line.startswith('C)') or line.startswith('В)'):
-                options['option_c'] = line[2:].strip()
-            elif line.startswith('D)') or line.startswith('Г)'):
-                options['option_d'] = line[2:].strip()
-            elif line.lower().startswith('javob:') or line.lower().startswith('ответ:'):
-                answer_part = line.split(':', 1)[1].strip().upper()
-                if answer_part in ['A', 'B', 'C', 'D', 'А', 'Б', 'В', 'Г']:
-                    # Convert Cyrillic to Latin if needed
-                    if answer_part == 'А':
-                        correct_answer = 'A'
-                    elif answer_part == 'Б':
-                        correct_answer = 'B'
-                    elif answer_part == 'В':
-                        correct_answer = 'C'
-                    elif answer_part == 'Г':
-                        correct_answer = 'D'
-                    else:
-                        correct_answer = answer_part
+        loop = asyncio.get_running_loop()
+        started = last_update = loop.time()
+        progress = await message.answer(f"📄 PDF o'qilmoqda... 0/{page_count} sahifa")
+        # Batches run on all workers at once and are parsed in order as they finish
+        tasks = [asyncio.ensure_future(run_in_process(extract_pdf_pages, path, start,
+                                                      min(start + PDF_PAGE_BATCH, page_count)))
+                 for start in range(0, page_count, PDF_PAGE_BATCH)]
+        parser = QuestionParser()
+        questions, pages_read = [], 0
+        for task in tasks:
+            pages = await task
+            pages_read += len(pages)
+            # The parser keeps an unfinished question for the next batch
+            lines = "\n".join(pages).splitlines()
+            questions += await run_blocking(lambda: list(parser.parse(lines)))
+            if loop.time() - last_update >= REPORT_PROGRESS_INTERVAL and pages_read < page_count:
+                last_update = loop.time()
+                try:
+                    await progress.edit_text(f"📄 PDF o'qilmoqda... {pages_read}/{page_count} sahifa, "
+                                             f"{len(questions)} savol ({last_update - started:.0f} s)")
+                except TelegramAPIError:
+                    pass
+        parser.finish()
+        final_text = f"✅ PDF o'qildi: {page_count} sahifa, {len(questions)} savol ({loop.time() - started:.0f} s)"
+        return questions, parser.diagnostics
+    finally:
+        for task in tasks:
+            task.cancel()
+        os.remove(path)
+        # The progress message shows the outcome instead of the last page count
+        if progress is not None:
+            try:
+                await progress.edit_text(final_text)
+            except TelegramAPIError:
+                pass
+
+# 📝 Question parser: one pass over the lines, each line classified by one pattern as an option
+# ("A) ...", "А) ...", "a. ..."), an answer marker ("Javob: A", "Ответ: А"; anything but one letter is
+# kept in bad_answer) or text
+QUESTION_LINE = re.compile(r"(?:(?P<letter>[a-dа-г])\s*[).]\s*(?P<option>.*)"
+                           r"|(?:javob|ответ)\s*:\s*(?:(?P<answer>[a-dа-г])\s*$|(?P<bad_answer>.*)))", re.IGNORECASE)
+# Page numbers PDFs put in footers ("- 2 -", "— 12 —"); these lines are skipped
+PAGE_NUMBER_LINE = re.compile(r"[-–—]\s*\d+\s*[-–—]")
+# Latin and Cyrillic option letters; Cyrillic В is the third option
+OPTION_LETTERS = {"a": "a", "b": "b", "c": "c", "d": "d", "а": "a", "б": "b", "в": "c", "г": "d"}
+
+class QuestionParser:
+    """Questions from text that may arrive in pieces. A block ends at its answer line; the first line of a block
+    is always question text, and other text lines continue the question or the last option. Without an answer,
+    a text line after a blank line starts a new block once all four options are in.
+    
+    Blocks that can't be used are reported in diagnostics as "<line>-qator: <start of block> — <problems>".
+    """
+    
+    def __init__(self):
+        self.line_no = 0
+        self.diagnostics: List[str] = []
+        self.after_blank = False
+        self._reset()
+    
+    def _reset(self) -> None:
+        self.start_line = 0
+        self.question: List[str] = []
+        self.options: Dict[str, str] = {}
+        self.last_option: Optional[str] = None
+        self.problems: List[str] = []
+    
+    def _pending(self) -> bool:
+        return bool(self.question or self.options or self.problems)
+    
+    def _close(self, answer: Optional[str]) -> Optional[Dict]:
+        """End the current block: the question, or None after reporting why it was skipped"""
+        problems = self.problems
+        if not self.question:
+            problems.append("savol matni yo'q")
+        missing = [letter.upper() for letter in "abcd" if letter not in self.options]
+        if missing:
+            problems.append(f"variant yo'q: {', '.join(missing)}")
+        if answer is None:
+            problems.append("javob yo'q")
+        # Prefaces and page footers before the first option end up in the question text
+        too_long = [name for name, text in [("savol", " ".join(self.question))] + [
+                        (f"{letter.upper()} variant", self.options[letter]) for letter in sorted(self.options)]
+                    if len(html.escape(text)) > QUESTION_TEXT_MAX_CHARS]
+        if too_long:
+            problems.append(f"matn juda uzun ({QUESTION_TEXT_MAX_CHARS} belgidan ko'p): {', '.join(too_long)}")
         
-        if len(options) == 4 and correct_answer:
-            questions.append({
-                'question': question_text,
-                'option_a': options['option_a'],
-                'option_b': options['option_b'],
-                'option_c': options['option_c'],
-                'option_d': options['option_d'],
-                'correct_answer': correct_answer
-            })
-    
-    return questions
+        question = None
+        if problems:
+            snippet = " ".join(self.question)[:40] or next(iter(self.options.values()), "")[:40]
+            self.diagnostics.append(f"{self.start_line}-qator: {snippet} — {'; '.join(problems)}")
+        else:
+            question = {'question': " ".join(self.question).rstrip('?') + '?'}
+            question.update((f"option_{letter}", self.options[letter]) for letter in "abcd")
+            question['correct_answer'] = answer.upper()
+        self._reset()
+        return question
+    
+    def parse(self, lines: Iterable[str]) -> Iterator[Dict]:
+        """Yield questions as their blocks end; state carries over to the next call"""
+        for line in lines:
+            self.line_no += 1
+            line = line.strip()
+            if not line:
+                self.after_blank = True
+                continue
+            if PAGE_NUMBER_LINE.fullmatch(line):
+                continue
+            after_blank, self.after_blank = self.after_blank, False
+            if not self._pending():
+                self.start_line = self.line_no
+            
+            match = QUESTION_LINE.match(line)
+            if match is not None and match.group('letter') and not self.question and not self.options:
+                # A question may itself start like an option ("A. Navoiy ...")
+                match = None
+            if match is None:
+                if not self.options:
+                    self.question.append(line)
+                elif len(self.options) == 4 and after_blank:
+                    # All options but no answer, then a new paragraph: this line starts the next question
+                    self._close(None)
+                    self.start_line = self.line_no
+                    self.question.append(line)
+                else:
+                    # Option text wrapped onto the next line
+                    self.options[self.last_option] = f"{self.options[self.last_option]} {line}"
+            elif match.group('letter'):
+                letter = OPTION_LETTERS[match.group('letter').lower()]
+                if letter in self.options:
+                    self.problems.append(f"{letter.upper()} variant takrorlangan")
+                self.options[letter] = match.group('option').strip()
+                self.last_option = letter
+            else:
+                if match.group('answer'):
+                    question = self._close(OPTION_LETTERS[match.group('answer').lower()])
+                else:
+                    self.problems.append(f"javob noto'g'ri: {match.group('bad_answer').strip()[:10]}")
+                    question = self._close("")
+                if question is not None:
+                    yield question
+    
+    def finish(self) -> None:
+        """Report a block left without its answer at the end of the text"""
+        if self._pending():
+            self._close(None)
+
+def parse_text_questions(text: str) -> tuple:
+    """(questions, diagnostics) from text format"""
+    parser = QuestionParser()
+    questions = list(parser.parse(text.splitlines()))
+    parser.finish()
+    return questions, parser.diagnostics
+
+def format_diagnostics(diagnostics: List[str], limit: int = 10) -> str:
+    lines = [f"\n⚠️ {len(diagnostics)} ta blok o'qilmadi:"] + [f"• {html.escape(d)}" for d in diagnostics[:limit]]
+    if len(diagnostics) > limit:
+        lines.append(f"... yana {len(diagnostics) - limit} ta")
+    return "\n".join(lines)
 
 @dp.message(F.text == "🗑 Test o'chirish")
-async def delete_test_age_prompt(message: types.Message, state: FSMContext):
+async def delete_test_age_prompt(message: types.Message, state: FSMContext, role: Optional[str] = None):
     """Prompt to select age group for deleting test (super admin only)"""
-    if not is_super_admin(message.from_user.id):
+    if role != "super_admin":
         await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
         return
     
@@ -1541,10 +3593,10 @@ async def delete_test_age_prompt(message: types.Message, state: FSMContext):
     await state.set_state(AdminStates.delete_test_age)
 
 @dp.message(AdminStates.delete_test_age)
-async def delete_test_age(message: types.Message, state: FSMContext):
+async def delete_test_age(message: types.Message, state: FSMContext, role: Optional[str] = None):
     """Select age group for test deletion"""
     if message.text == "🔙 Orqaga":
-        await back_button(message, state)
+        await back_button(message, state, role)
         return
     
     if message.text not in ["7-10 yosh", "11-14 yosh"]:
@@ -1552,7 +3604,7 @@ async def delete_test_age(message: types.Message, state: FSMContext):
         return
     
     age_group = message.text.split()[0]  # "7-10" or "11-14"
-    tests = get_tests()
+    tests = await get_tests_async()
     available_tests = tests.get(age_group, {})
     
     if not available_tests:
@@ -1571,24 +3623,25 @@ async def delete_test_age(message: types.Message, state: FSMContext):
     
     test_keyboard = ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
     
-    await state.update_data(age_group=age_group, available_tests=available_tests)
+    test_names = {test_id: test_data.get('book_name', 'Noma\'lum') for test_id, test_data in available_tests.items()}
+    await state.update_data(age_group=age_group, test_names=test_names)
     await message.answer("🗑 O'chirish uchun testni tanlang:", reply_markup=test_keyboard)
     await state.set_state(AdminStates.delete_test_select)
 
 @dp.message(AdminStates.delete_test_select)
-async def delete_test_confirm(message: types.Message, state: FSMContext):
+async def delete_test_confirm(message: types.Message, state: FSMContext, role: Optional[str] = None):
     """Confirm test deletion"""
     if message.text == "🔙 Orqaga":
-        await back_button(message, state)
+        await back_button(message, state, role)
         return
     
     data = await state.get_data()
     age_group = data['age_group']
-    available_tests = data['available_tests']
+    test_names = data['test_names']
     
     # Find selected test by partial ID
     selected_test_id = None
-    for test_id in available_tests.keys():
+    for test_id in test_names.keys():
         if test_id[:8] in message.text:
             selected_test_id = test_id
             break
@@ -1598,11 +3651,9 @@ async def delete_test_confirm(message: types.Message, state: FSMContext):
         return
     
     # Delete test
-    tests = get_tests()
-    del tests[age_group][selected_test_id]
-    save_json_data(TESTS_FILE, tests)
+    await delete_test_async(age_group, selected_test_id)
     
-    test_name = available_tests[selected_test_id].get('book_name', 'Noma\'lum')
+    test_name = test_names[selected_test_id]
     
     await message.answer(
         f"✅ Test muvaffaqiyatli o'chirildi!\n📚 Kitob: {test_name}",
@@ -1611,36 +3662,60 @@ async def delete_test_confirm(message: types.Message, state: FSMContext):
     
     await state.clear()
 
+async def run_report_jobs(message: types.Message, title: str, kinds: Dict[str, str],
+                          render=render_report_async) -> Dict[str, Any]:
+    """Render reports (kind -> label) in parallel, keeping one progress message up to date"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    progress = await message.answer(f"{title} tayyorlanmoqda...")
+    tasks = {asyncio.ensure_future(render(kind)): kind for kind in kinds}
+    pending = set(tasks)
+    
+    try:
+        while pending:
+            _, pending = await asyncio.wait(pending, timeout=REPORT_PROGRESS_INTERVAL)
+            if not pending:
+                break
+            status = ", ".join(f"{kinds[kind]} {'⏳' if task in pending else '✅'}" for task, kind in tasks.items())
+            try:
+                await progress.edit_text(f"{title} tayyorlanmoqda... {status} ({loop.time() - started:.0f} s)")
+            except TelegramAPIError:
+                pass
+    finally:
+        for task in pending:
+            task.cancel()
+    
+    return {kind: task.result() for task, kind in tasks.items()}
+
+async def send_pdf_parts(chat_id: int, parts: List[bytes], name: str, caption: str) -> None:
+    """Send a PDF report; split reports go out as name_1.pdf, name_2.pdf, ..."""
+    for i, pdf_data in enumerate(parts, 1):
+        if len(parts) == 1:
+            await bot.send_document(chat_id, BufferedInputFile(pdf_data, filename=f"{name}.pdf"), caption=caption)
+        else:
+            await bot.send_document(chat_id, BufferedInputFile(pdf_data, filename=f"{name}_{i}.pdf"),
+                                    caption=f"{caption} — {i}/{len(parts)}")
+
 @dp.message(F.text == "📊 Test natijalarini yuklab olish")
-async def download_test_results(message: types.Message):
+async def download_test_results(message: types.Message, role: Optional[str] = None):
     """Download test results in PDF and Excel format (super admin only)"""
-    if not is_super_admin(message.from_user.id):
+    if role != "super_admin":
         await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
         return
     
-    results = get_results()
-    
-    if not results:
+    if not await has_results_async():
         await message.answer("📊 Hozircha test natijalari mavjud emas.")
         return
     
     try:
-        await message.answer("📊 Test natijalari tayyorlanmoqda...")
-        
-        # Generate PDF report
-        pdf_data = generate_pdf_report(results)
-        pdf_file = BufferedInputFile(pdf_data, filename="test_results.pdf")
-        
-        # Generate Excel report
-        excel_data = generate_excel_report(results)
-        excel_file = BufferedInputFile(excel_data, filename="test_results.xlsx")
+        # Generate PDF (one or more files) and Excel reports in parallel
+        reports = await run_report_jobs(message, "📊 Test natijalari",
+                                        {"results_pdf": "PDF", "results_excel": "Excel"})
+        pdf_parts = reports["results_pdf"]
+        excel_file = BufferedInputFile(reports["results_excel"], filename="test_results.xlsx")
         
         # Send PDF
-        await bot.send_document(
-            message.from_user.id,
-            pdf_file,
-            caption="📄 Test natijalari (PDF format)"
-        )
+        await send_pdf_parts(message.from_user.id, pdf_parts, "test_results", "📄 Test natijalari (PDF format)")
         
         # Send Excel
         await bot.send_document(
@@ -1656,35 +3731,25 @@ async def download_test_results(message: types.Message):
         await message.answer(f"❌ Test natijalari hisobotini yaratishda xatolik: {e}")
 
 @dp.message(F.text == "📋 Foydalanuvchi ma'lumotlarini yuklab olish")
-async def download_user_data(message: types.Message):
+async def download_user_data(message: types.Message, role: Optional[str] = None):
     """Download user data in PDF and Excel format (super admin only)"""
-    if not is_super_admin(message.from_user.id):
+    if role != "super_admin":
         await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
         return
     
-    users = get_users()
-    
-    if not users:
+    if not _get_user_index().count():
         await message.answer("📋 Hozircha ro'yxatdan o'tgan foydalanuvchilar yo'q.")
         return
     
     try:
-        await message.answer("📋 Foydalanuvchi ma'lumotlari tayyorlanmoqda...")
-        
-        # Generate PDF report
-        pdf_data = generate_users_pdf_report(users)
-        pdf_file = BufferedInputFile(pdf_data, filename="users_data.pdf")
-        
-        # Generate Excel report
-        excel_data = generate_users_excel_report(users)
-        excel_file = BufferedInputFile(excel_data, filename="users_data.xlsx")
+        # Generate PDF (one or more files) and Excel reports in parallel
+        reports = await run_report_jobs(message, "📋 Foydalanuvchi ma'lumotlari",
+                                        {"users_pdf": "PDF", "users_excel": "Excel"})
+        pdf_parts = reports["users_pdf"]
+        excel_file = BufferedInputFile(reports["users_excel"], filename="users_data.xlsx")
         
         # Send PDF
-        await bot.send_document(
-            message.from_user.id,
-            pdf_file,
-            caption="📄 Foydalanuvchi ma'lumotlari (PDF format)"
-        )
+        await send_pdf_parts(message.from_user.id, pdf_parts, "users_data", "📄 Foydalanuvchi ma'lumotlari (PDF format)")
         
         # Send Excel
         await bot.send_document(
@@ -1699,6 +3764,408 @@ async def download_user_data(message: types.Message):
         logging.error(f"Error generating user data reports: {e}")
         await message.answer(f"❌ Foydalanuvchi ma'lumotlari hisobotini yaratishda xatolik: {e}")
 
+@dp.message(F.text == "📦 Xom ma'lumotlar (CSV/NDJSON)")
+async def raw_export_prompt(message: types.Message, role: Optional[str] = None):
+    """Choose data and format of a raw export (super admin only)"""
+    if role != "super_admin":
+        await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
+        return
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"{label} — {fmt.upper()}", callback_data=f"export:{source}:{fmt}")
+         for fmt in EXPORT_FORMATS]
+        for source, label in [("results", "📊 Natijalar"), ("users", "📋 Foydalanuvchilar")]
+    ])
+    await message.answer(
+        "📦 Xom ma'lumotlar gzip bilan siqilgan bitta faylda yuboriladi.\n"
+        "Natijalarda har bir savolga berilgan javoblar ham bor.",
+        reply_markup=keyboard
+    )
+
+@dp.callback_query(F.data.startswith("export:"))
+async def raw_export(callback_query: types.CallbackQuery, role: Optional[str] = None):
+    """Write the raw export in the process pool and send it as one document"""
+    if role != "super_admin":
+        await callback_query.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!", show_alert=True)
+        return
+    
+    _, source, fmt = callback_query.data.split(":")
+    if source not in ("results", "users") or fmt not in EXPORT_FORMATS:
+        await callback_query.answer()
+        return
+    await callback_query.answer()
+    
+    title = "Test natijalari" if source == "results" else "Foydalanuvchi ma'lumotlari"
+    name = "test_results" if source == "results" else "users_data"
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz", dir=DATA_DIR)
+    os.close(fd)
+    try:
+        # The worker reads the files, so pending JSON saves must reach the disk first
+        await flush_all_json()
+        counts = await run_report_jobs(callback_query.message, f"📦 {title}", {fmt: fmt.upper()},
+                                       render=lambda kind: run_in_process(write_raw_export, source, kind, path))
+        await bot.send_document(callback_query.from_user.id, FSInputFile(path, filename=f"{name}.{fmt}.gz"),
+                                caption=f"📦 {title} ({fmt.upper()}, gzip): {counts[fmt]} ta")
+    except Exception as e:
+        logging.error(f"Error writing raw export: {e}")
+        await callback_query.message.answer(f"❌ Eksportni yaratishda xatolik: {e}")
+    finally:
+        os.remove(path)
+
+# 🔎 Filtered reports (super admin only): data -> region -> district -> age group -> dates
+def _choice_keyboard(options: List[str], any_option: str) -> ReplyKeyboardMarkup:
+    buttons = [KeyboardButton(text=option) for option in options]
+    keyboard = [[KeyboardButton(text=any_option)]] + [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    keyboard.append([KeyboardButton(text="🔙 Orqaga")])
+    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+
+def describe_filters(filters: Dict) -> str:
+    place = " / ".join(filter(None, [filters.get('region'), filters.get('district')])) or "Barcha viloyatlar"
+    dates = f"{filters['date_from']} — {filters['date_to']}" if filters.get('date_from') else "Barcha sanalar"
+    return f"🌍 {place} | 📅 {filters.get('age_group') or 'Barcha yoshlar'} | 📆 {dates}"
+
+@dp.message(F.text == "🔎 Filtrlangan hisobot")
+async def filtered_report_start(message: types.Message, state: FSMContext, role: Optional[str] = None):
+    """Start a filtered report (super admin only)"""
+    if role != "super_admin":
+        await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
+        return
+    
+    keyboard = ReplyKeyboardMarkup(keyboard=[
+        [KeyboardButton(text="📊 Test natijalari"), KeyboardButton(text="📋 Foydalanuvchilar")],
+        [KeyboardButton(text="🔙 Orqaga")]
+    ], resize_keyboard=True)
+    await message.answer("🔎 Qaysi ma'lumotlar kerak?", reply_markup=keyboard)
+    await state.set_state(AdminStates.report_source)
+
+@dp.message(AdminStates.report_source)
+async def filtered_report_source(message: types.Message, state: FSMContext, role: Optional[str] = None):
+    """Choose results or users"""
+    if role != "super_admin":
+        await state.clear()
+        await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
+        return
+    
+    if message.text == "🔙 Orqaga":
+        await back_button(message, state, role)
+        return
+    
+    sources = {"📊 Test natijalari": "results", "📋 Foydalanuvchilar": "users"}
+    if message.text not in sources:
+        await message.answer("❌ Iltimos, tugmalardan birini tanlang!")
+        return
+    
+    await state.update_data(report_source=sources[message.text])
+    await message.answer("🌍 Viloyatni tanlang:", reply_markup=_choice_keyboard(REGION_NAMES, "🌍 Barcha viloyatlar"))
+    await state.set_state(AdminStates.report_region)
+
+@dp.message(AdminStates.report_region)
+async def filtered_report_region(message: types.Message, state: FSMContext, role: Optional[str] = None):
+    """Choose region"""
+    if role != "super_admin":
+        await state.clear()
+        await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
+        return
+    
+    if message.text == "🔙 Orqaga":
+        await back_button(message, state, role)
+        return
+    
+    if message.text == "🌍 Barcha viloyatlar":
+        await state.update_data(region=None, district=None)
+        await message.answer("📅 Yosh guruhini tanlang:",
+                             reply_markup=_choice_keyboard(["7-10 yosh", "11-14 yosh"], "📅 Barcha yoshlar"))
+        await state.set_state(AdminStates.report_age)
+        return
+    
+    if message.text not in REGIONS:
+        await message.answer("❌ Iltimos, viloyatni ro'yxatdan tanlang!")
+        return
+    
+    await state.update_data(region=message.text)
+    await message.answer("🏙 Tumanni tanlang:", reply_markup=_choice_keyboard(REGIONS[message.text], "🏙 Barcha tumanlar"))
+    await state.set_state(AdminStates.report_district)
+
+@dp.message(AdminStates.report_district)
+async def filtered_report_district(message: types.Message, state: FSMContext, role: Optional[str] = None):
+    """Choose district"""
+    if role != "super_admin":
+        await state.clear()
+        await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
+        return
+    
+    if message.text == "🔙 Orqaga":
+        await back_button(message, state, role)
+        return
+    
+    data = await state.get_data()
+    if message.text == "🏙 Barcha tumanlar":
+        district = None
+    elif message.text in REGIONS[data['region']]:
+        district = message.text
+    else:
+        await message.answer("❌ Iltimos, tumanni ro'yxatdan tanlang!")
+        return
+    
+    await state.update_data(district=district)
+    await message.answer("📅 Yosh guruhini tanlang:",
+                         reply_markup=_choice_keyboard(["7-10 yosh", "11-14 yosh"], "📅 Barcha yoshlar"))
+    await state.set_state(AdminStates.report_age)
+
+@dp.message(AdminStates.report_age)
+async def filtered_report_age(message: types.Message, state: FSMContext, role: Optional[str] = None):
+    """Choose age group"""
+    if role != "super_admin":
+        await state.clear()
+        await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
+        return
+    
+    if message.text == "🔙 Orqaga":
+        await back_button(message, state, role)
+        return
+    
+    if message.text == "📅 Barcha yoshlar":
+        age_group = None
+    elif message.text in ["7-10 yosh", "11-14 yosh"]:
+        age_group = message.text.split()[0]
+    else:
+        await message.answer("❌ Iltimos, yosh guruhini tanlang!")
+        return
+    
+    await state.update_data(age_group=age_group)
+    keyboard = ReplyKeyboardMarkup(keyboard=[
+        [KeyboardButton(text="📆 Barcha sanalar")],
+        [KeyboardButton(text="🔙 Orqaga")]
+    ], resize_keyboard=True)
+    await message.answer(
+        "📆 Sana oralig'ini kiriting (masalan: 2025-01-01 2025-03-31)\n"
+        "yoki barcha sanalar uchun tugmani bosing:",
+        reply_markup=keyboard
+    )
+    await state.set_state(AdminStates.report_dates)
+
+@dp.message(AdminStates.report_dates)
+async def filtered_report_dates(message: types.Message, state: FSMContext, role: Optional[str] = None):
+    """Read date range and send the filtered reports"""
+    if role != "super_admin":
+        await state.clear()
+        await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
+        return
+    
+    if message.text == "🔙 Orqaga":
+        await back_button(message, state, role)
+        return
+    
+    date_from = date_to = None
+    if message.text != "📆 Barcha sanalar":
+        try:
+            date_from, date_to = (message.text or "").split()
+            if datetime.strptime(date_from, "%Y-%m-%d") > datetime.strptime(date_to, "%Y-%m-%d"):
+                raise ValueError
+        except ValueError:
+            await message.answer("❌ Noto'g'ri format! Masalan: 2025-01-01 2025-03-31")
+            return
+    
+    data = await state.get_data()
+    await state.clear()
+    filters = {key: data.get(key) for key in ("region", "district", "age_group")}
+    filters.update(date_from=date_from, date_to=date_to)
+    source = data['report_source']
+    menu = get_admin_menu(True)
+    
+    # Only the filters and, with JSON, the matching refs from the indexes go to the workers; they read the rows
+    refs = await run_blocking(filtered_refs, source, filters)
+    if refs == []:
+        await message.answer(f"📝 Bu filtr bo'yicha ma'lumot topilmadi.\n{describe_filters(filters)}", reply_markup=menu)
+        return
+    
+    title = "Test natijalari" if source == "results" else "Foydalanuvchi ma'lumotlari"
+    name = "test_results" if source == "results" else "users_data"
+    try:
+        # Worker processes read the files, so pending JSON saves must reach the disk first
+        await flush_all_json()
+        reports = await run_report_jobs(message, f"🔎 {title}", {f"{source}_pdf": "PDF", f"{source}_excel": "Excel"},
+                                        render=lambda kind: run_in_process(render_filtered_report, kind, filters, refs))
+        (pdf_parts, count), (excel_data, _) = reports[f"{source}_pdf"], reports[f"{source}_excel"]
+        if not count:
+            await message.answer(f"📝 Bu filtr bo'yicha ma'lumot topilmadi.\n{describe_filters(filters)}",
+                                 reply_markup=menu)
+            return
+        
+        details = f"{count} ta\n{describe_filters(filters)}"
+        await send_pdf_parts(message.from_user.id, pdf_parts, f"{name}_filtered", f"📄 {title} (PDF format): {details}")
+        await bot.send_document(message.from_user.id,
+                                BufferedInputFile(excel_data, filename=f"{name}_filtered.xlsx"),
+                                caption=f"📊 {title} (Excel format): {details}")
+        await message.answer("✅ Hisobot muvaffaqiyatli yuklandi!", reply_markup=menu)
+    except Exception as e:
+        logging.error(f"Error generating filtered report: {e}")
+        await message.answer(f"❌ Hisobotni yaratishda xatolik: {e}", reply_markup=menu)
+
+# 📈 Question analytics (all admins): served from the per-question counters, no results are read
+def _short(text: Any, limit: int = 60) -> str:
+    text = str(text)
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def question_stats_report() -> tuple:
+    """Text with the hardest and most skipped questions per book and age group, plus a CSV of all questions"""
+    books = question_stats.by_book()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['Yosh guruhi', 'Kitob', 'Savol ID', 'Savol', "To'g'ri javob", 'Urinishlar', "To'g'ri %",
+                     "Vaqt tugagan %", 'A', 'B', 'C', 'D'])
+    lines = []
+    for (age_group, book_name), questions in sorted(books.items()):
+        for question_id, question, (attempts, correct, timeouts, *choices) in questions:
+            writer.writerow([age_group, book_name, question_id, question.get('question', ''),
+                             question.get('correct_answer', ''), attempts, round(correct * 100 / attempts, 1),
+                             round(timeouts * 100 / attempts, 1), *choices])
+        
+        ranked = [q for q in questions if q[2][0] >= QUESTION_STATS_MIN_ATTEMPTS]
+        lines.append(f"\n📚 <b>{html.escape(book_name)}</b> ({age_group}): {len(questions)} savol, "
+                     f"{sum(q[2][0] for q in questions)} javob")
+        if not ranked:
+            lines.append(f"   Kamida {QUESTION_STATS_MIN_ATTEMPTS} marta javob berilgan savollar yo'q")
+            continue
+        lines.append("🔴 Eng qiyin:")
+        for _, question, counts in heapq.nsmallest(QUESTION_STATS_TOP, ranked, key=lambda q: q[2][1] / q[2][0]):
+            lines.append(f"   {counts[1] * 100 / counts[0]:.0f}% — {html.escape(_short(question.get('question', '')))}")
+        lines.append("⏰ Ko'p o'tkazib yuborilgan:")
+        for _, question, counts in heapq.nlargest(QUESTION_STATS_TOP, ranked, key=lambda q: q[2][2] / q[2][0]):
+            lines.append(f"   {counts[2] * 100 / counts[0]:.0f}% — {html.escape(_short(question.get('question', '')))}")
+    
+    text = "📈 <b>Savollar tahlili</b>\n" + "\n".join(lines)
+    if len(text) > 4000:
+        text = text[:text.rfind("\n", 0, 3950)] + "\n\n… to'liq ro'yxat faylda"
+    return text, buffer.getvalue().encode('utf-8')
+
+@dp.message(Command("questions"))
+async def show_question_stats(message: types.Message, role: Optional[str] = None):
+    """Hardest and most skipped questions per book and age group (admins)"""
+    if not role:
+        await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
+        return
+    
+    if not question_stats.data or not question_stats.data["questions"]:
+        await message.answer("📈 Hozircha savollar bo'yicha javoblar yo'q.")
+        return
+    
+    text, csv_data = await run_blocking(question_stats_report)
+    await message.answer(text)
+    await message.answer_document(BufferedInputFile(csv_data, filename="question_stats.csv"),
+                                  caption="📈 Barcha savollar bo'yicha statistika")
+
+# 🏆 Leaderboards (all admins): one message, edited in place; callback data is "top:<region #>:<district #>:<age group>"
+def _top_callback(region: Optional[str], district: Optional[str], age_group: Optional[str]) -> str:
+    region_part = REGION_NAMES.index(region) if region else "-"
+    district_part = REGIONS[region].index(district) if district else "-"
+    return f"top:{region_part}:{district_part}:{age_group or '-'}"
+
+def render_leaderboard(region: Optional[str], district: Optional[str], age_group: Optional[str]) -> tuple:
+    """Text and keyboard of one leaderboard"""
+    place = " / ".join(filter(None, [region, district])) or "Barcha viloyatlar"
+    lines = [f"🏆 <b>Reyting</b> (top {LEADERBOARD_SIZE})",
+             f"🌍 {html.escape(place)} | 📅 {age_group or 'Barcha yoshlar'}", ""]
+    entries = leaderboards.top(region, district, age_group)
+    if not entries:
+        lines.append("📝 Natijalar topilmadi.")
+    for i, (score, _, _, user_id, name, time_taken) in enumerate(entries, 1):
+        medal = {1: "🥇", 2: "🥈", 3: "🥉"}.get(i, f"{i}.")
+        lines.append(f"{medal} {html.escape(_short(name, 40))} — {score} ball, ⏱ {time_taken} (🆔 {user_id})")
+    
+    next_age_group = {None: "7-10", "7-10": "11-14", "11-14": None}[age_group]
+    age_part = age_group or "-"
+    buttons = [InlineKeyboardButton(text="🌍 Viloyat", callback_data=f"top_regions:{age_part}")]
+    if region:
+        buttons.append(InlineKeyboardButton(text="🏙 Tuman",
+                                            callback_data=f"top_districts:{REGION_NAMES.index(region)}:{age_part}"))
+    buttons.append(InlineKeyboardButton(text=f"📅 {next_age_group or 'Barcha yoshlar'}",
+                                        callback_data=_top_callback(region, district, next_age_group)))
+    text = "\n".join(lines)
+    # Cut between lines, never inside an escaped name
+    if len(text) > 4000:
+        text = text[:text.rfind("\n", 0, 3990)] + "\n…"
+    return text, InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+@dp.message(Command("top"))
+async def show_leaderboard(message: types.Message, role: Optional[str] = None):
+    """Show the top results overall, then per region, district and age group (admins)"""
+    if not role:
+        await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
+        return
+    
+    text, keyboard = render_leaderboard(None, None, None)
+    await message.answer(text, reply_markup=keyboard)
+
+@dp.callback_query(F.data.startswith("top"))
+async def browse_leaderboards(callback_query: types.CallbackQuery, role: Optional[str] = None):
+    """Leaderboard, region picker and district picker callbacks"""
+    if not role:
+        await callback_query.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!", show_alert=True)
+        return
+    
+    action, _, args = callback_query.data.partition(":")
+    try:
+        if action == "top_regions":
+            age_group = parse_age_part(args)
+            options = [("🌍 Barcha viloyatlar", _top_callback(None, None, age_group))]
+            options += [(region, _top_callback(region, None, age_group)) for region in REGION_NAMES]
+        elif action == "top_districts":
+            region_part, age_part = args.split(":")
+            region, age_group = REGION_NAMES[int(region_part)], parse_age_part(age_part)
+            options = [("🏙 Barcha tumanlar", _top_callback(region, None, age_group))]
+            options += [(district, _top_callback(region, district, age_group)) for district in REGIONS[region]]
+        else:
+            region_part, district_part, age_part = args.split(":")
+            region = None if region_part == "-" else REGION_NAMES[int(region_part)]
+            district = None if district_part == "-" else REGIONS[region][int(district_part)]
+            age_group = parse_age_part(age_part)
+            text, keyboard = render_leaderboard(region, district, age_group)
+            await callback_query.message.edit_text(text, reply_markup=keyboard)
+            await callback_query.answer()
+            return
+    except (ValueError, IndexError, KeyError):
+        await callback_query.answer("⚠️ Eskirgan tugma, reytingni qaytadan oching.", show_alert=True)
+        return
+    
+    # Pickers replace the keyboard; the first option clears that filter
+    buttons = [InlineKeyboardButton(text=text, callback_data=data) for text, data in options[1:]]
+    keyboard = [[InlineKeyboardButton(text=options[0][0], callback_data=options[0][1])]]
+    keyboard += [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    await callback_query.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+    await callback_query.answer()
+
+@dp.message(Command("stats"))
+async def show_stats(message: types.Message, role: Optional[str] = None):
+    """Show storage cache statistics (super admin only)"""
+    if role != "super_admin":
+        await message.answer("❌ Sizda bu buyruqni bajarish huquqi yo'q!")
+        return
+    
+    stats = get_cache_stats()
+    question_index = _get_question_index()
+    question_counts = ", ".join(f"{age_group}: {question_index.count(age_group)}" for age_group in question_index.refs)
+    sub_stats = subscription_cache.stats
+    digest_state = "yoqilgan" if admin_notifier.digest_active else "o'chirilgan"
+    await message.answer(
+        f"📈 Statistika:\n\n"
+        f"🗄 Kesh: {stats['hits']} hit / {stats['misses']} miss\n"
+        f"📁 Keshdagi fayllar: {stats['cached_files']}\n"
+        f"📚 Savollar: {question_counts}\n"
+        f"🧩 Savol keshi: {question_payloads.size} ta, {question_payloads.stats['hits']} hit / "
+        f"{question_payloads.stats['misses']} miss\n"
+        f"⏰ Kutilayotgan taymerlar: {question_deadlines.pending}\n"
+        f"📣 Admin xabarlari: {admin_notifier.stats['sent']} yuborildi, {admin_notifier.queued} navbatda, "
+        f"{admin_notifier.stats['retried']} qayta, {admin_notifier.stats['failed']} xato\n"
+        f"🗂 Xulosa rejimi: {NOTIFY_DIGEST} ({digest_state}), "
+        f"{admin_notifier.digest_pending} ta hodisa kutmoqda\n"
+        f"✉️ Obuna keshi: {subscription_cache.size} ta, {sub_stats['hits']} hit / {sub_stats['misses']} miss, "
+        f"{sub_stats['errors']} xato, {sub_stats['rechecked']} qayta tekshirildi\n"
+        f"💾 Saqlashlar: {stats['saves']} / diskka yozish: {stats['writes']}\n"
+        f"⏱ Event loop maks. kechikish: {LOOP_STATS['max_lag_ms']:.1f} ms "
+        f"({LOOP_STATS['slow_ticks']} marta > {LOOP_LAG_WARN_MS:.0f} ms)"
+    )
+
 # 🛡 Security handlers
 @dp.message(F.text.contains("t.me") | F.text.contains("http") | F.text.contains("@"))
 async def block_ads(message: types.Message):
@@ -1710,26 +4177,44 @@ async def block_ads(message: types.Message):
             pass
 
 # 📣 Main function
+async def on_shutdown():
+    """Stop timers and background senders before aiogram closes the FSM storage they write to"""
+    await question_deadlines.stop()
+    await admin_notifier.stop()
+    await subscription_cache.stop()
+
+# aiogram registers closing the FSM storage as the first shutdown handler; ours has to run before it
+dp.shutdown.register(on_shutdown)
+dp.shutdown.handlers.insert(0, dp.shutdown.handlers.pop())
+
 async def main():
     """Main function to start the bot"""
+    global _storage_loop
+    _storage_loop = asyncio.get_running_loop()
     await bot.delete_webhook(drop_pending_updates=True)
     
-    # Initialize data files
-    if not os.path.exists(ADMINS_FILE):
-        default_admins = {str(SUPER_ADMIN_ID): {"role": "super_admin", "added_by": "system", "added_date": datetime.now().isoformat()}}
-        save_json_data(ADMINS_FILE, default_admins)
-    
-    if not os.path.exists(TESTS_FILE):
-        save_json_data(TESTS_FILE, {"7-10": {}, "11-14": {}})
-    
-    if not os.path.exists(USERS_FILE):
-        save_json_data(USERS_FILE, {})
-    
-    if not os.path.exists(RESULTS_FILE):
-        save_json_data(RESULTS_FILE, [])
+    # Initialize data storage and in-memory indexes
+    await run_blocking(init_storage)
+    await run_blocking(load_indexes)
+    lag_monitor = asyncio.create_task(monitor_loop_lag())
+    question_deadlines.start()
+    restored = restore_question_deadlines()
+    if restored:
+        logging.info(f"Restored question timers of {restored} unfinished tests")
+    admin_notifier.start()
+    subscription_cache.start()
+    warm_up_process_pool()
     
     logging.info("Bot started successfully!")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        lag_monitor.cancel()
+        await flush_all_json()
+        shutdown_process_pool()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if sys.argv[1:] == ["import-json"]:
+        import_json_to_sqlite()
+    else:
+        asyncio.run(main())
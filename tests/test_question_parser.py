@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+
+# main.py reads its configuration and creates bot_data/ in the working directory on import
+os.environ.setdefault("SUPER_ADMIN_ID", "1")
+os.chdir(tempfile.mkdtemp())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import parse_text_questions  # noqa: E402
+
+
+def test_wrapped_last_option_is_joined():
+    questions, diagnostics = parse_text_questions("Savol\nA) a\nB) b\nC) c\nD) uzun variant\ndavomi\nJavob: A")
+    assert diagnostics == []
+    assert len(questions) == 1
+    assert questions[0]['option_d'] == "uzun variant davomi"
+    assert questions[0]['correct_answer'] == "A"
+
+
+def test_question_text_starting_like_an_option():
+    text = "A. Navoiy kim bo'lgan?\nA) shoir\nB) olim\nC) vazir\nD) sarkarda\nJavob: A"
+    questions, diagnostics = parse_text_questions(text)
+    assert diagnostics == []
+    assert questions[0]['question'] == "A. Navoiy kim bo'lgan?"
+    assert questions[0]['option_a'] == "shoir"
+
+
+def test_answer_must_be_one_letter():
+    for answer in ("Ab", "Barchasi"):
+        questions, diagnostics = parse_text_questions(f"Savol\nA) a\nB) b\nC) c\nD) d\nJavob: {answer}")
+        assert questions == []
+        assert "javob noto'g'ri" in diagnostics[0]
+
+
+def test_cyrillic_options_and_answer():
+    questions, _ = parse_text_questions("Savol\nА) бир\nБ) икки\nВ) уч\nГ) турт\nОтвет: В")
+    assert questions[0]['correct_answer'] == "C"
+
+
+def test_overlong_text_is_reported():
+    preface = "Kirish so'zi. " * 300
+    questions, diagnostics = parse_text_questions(f"{preface}\nSavol\nA) a\nB) b\nC) c\nD) d\nJavob: A\n"
+                                                  f"Savol 2\nA) a\nB) {'uzun ' * 800}\nC) c\nD) d\nJavob: B")
+    assert questions == []
+    assert "matn juda uzun" in diagnostics[0] and "savol" in diagnostics[0]
+    assert "B variant" in diagnostics[1]
+
+
+def test_page_number_footers_are_skipped():
+    text = "Savol 1\nA) a\nB) b\nC) c\nD) d\nJavob: A\n- 2 -\nSavol 2\nA) a\nB) b\nC) c\nD) d\nJavob: B"
+    questions, diagnostics = parse_text_questions(text)
+    assert diagnostics == []
+    assert questions[1]['question'] == "Savol 2?"